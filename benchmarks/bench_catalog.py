@@ -0,0 +1,191 @@
+# coding=utf-8
+
+""" Harvests a synthetic catalog from a fake Galaxy server, then times searches and every route of the webapp
+
+    $ python benchmarks/bench_catalog.py --output=before.json
+    $ python benchmarks/bench_catalog.py --instances=20 --tools=2000 --versions=10000 --database=postgresql:///galaxycat_bench --reset
+
+Use a scratch database, its tables are dropped and created again.
+"""
+
+import click
+import json
+import os
+import platform
+import shutil
+import sqlalchemy
+import tempfile
+import timeit
+
+from fake_galaxy import FakeGalaxyServer, load_payloads
+from galaxycat import __version__
+from galaxycat.app import app, db, page_cache
+from galaxycat.catalog import EDAMOperation, Instance, Tool, ToolVersion, geo_cache, load_availability_index, parsed_search_queries, toolversion_instance
+from galaxycat.drift import load_version_drift
+from galaxycat.fulltext import create_search_index
+from galaxycat.instrument import HarvestStats
+from synthetic import SELECTIVE_WORDS, bump_versions, generate_catalog, operation_id, operation_label
+
+
+def measure(function, repeat):
+    """ Returns the min, median and max duration of ``repeat`` calls of ``function``, in seconds """
+
+    timings = sorted(timeit.repeat(function, number=1, repeat=repeat))
+    return {'min': timings[0], 'median': timings[len(timings) // 2], 'max': timings[-1], 'repeat': repeat}
+
+
+def create_catalog(database_uri, reset):
+
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_uri
+    if db.engine.dialect.has_table(db.engine, 'instance') and not reset:
+        raise click.ClickException("%s already holds a catalog, use --reset to drop it" % database_uri)
+
+    db.drop_all()
+    search_index = create_search_index(db, app.config['SEARCH_BACKEND'])
+    if search_index is not None:
+        search_index.drop()
+    db.create_all()
+    if search_index is not None:
+        search_index.create()
+    db.session.commit()
+
+
+def harvest(name, edam_dump=None):
+
+    stats = Tool.update_catalog(edam_dump=edam_dump, stats=HarvestStats(db.engine))
+    report = stats.to_dict()
+    del report['instances']
+    report['tools'] = Tool.query.count()
+    report['versions'] = ToolVersion.query.count()
+    report['links'] = db.session.execute(toolversion_instance.count()).scalar()
+    print "%-44s %8.2f s  %d statements" % ('harvest %s' % name, report['duration'], report['statements'])
+    return report
+
+
+def search_queries(catalog):
+    """ Searches from broad to empty, filters use the most populated instance and operation """
+
+    instance = max(catalog, key=lambda name: len(catalog[name][1]))
+    queries = [('word %s (%g%% of the tools)' % (word, frequency * 100), word) for word, frequency in SELECTIVE_WORDS]
+    queries.extend([('two words', u'%s %s' % (SELECTIVE_WORDS[0][0], SELECTIVE_WORDS[1][0])),
+                    ('prefix', u'tool1'),
+                    ('topic', u'topic:"%s"' % operation_label(0)),
+                    ('instance', u'instance:%s' % instance),
+                    ('word topic instance', u'%s topic:"%s" instance:%s' % (SELECTIVE_WORDS[0][0], operation_label(0), instance)),
+                    ('no match', u'nomatchatall')])
+    return queries
+
+
+def bench_search(queries, repeat):
+
+    results = {}
+    for name, query in queries:
+        def search():
+            Tool.search(query, limit=app.config['SEARCH_PER_PAGE'])
+            return Tool.search_count(query)
+        count = search()
+        results[name] = measure(search, repeat)
+        results[name].update({'query': query, 'count': count})
+        print "%-44s %8.2f ms  %d tools" % ('search %s' % name, results[name]['median'] * 1000, count)
+    return results
+
+
+def bench_routes(queries, repeat):
+
+    client = app.test_client()
+    tool_id = Tool.query.order_by(Tool.id).first().id
+    routes = [('/', '/'), ('/tools/<id>', '/tools/%d' % tool_id), ('/instances', '/instances'), ('/topics', '/topics'),
+              ('/about', '/about'), ('/api/tools', '/api/tools'), ('/api/tools/<id>', '/api/tools/%d' % tool_id),
+              ('/api/instances', '/api/instances'), ('/api/topics', '/api/topics'), ('/drift', '/drift'), ('/drift.csv', '/drift.csv')]
+    routes.extend(('/?search=%s' % name, '/?search=%s' % query) for name, query in queries)
+
+    results = {}
+    for name, path in routes:
+        def cold():
+            page_cache.clear()
+            parsed_search_queries.clear()
+            return client.get(path)
+
+        def warm():
+            return client.get(path)
+
+        response = cold()
+        if response.status_code != 200:
+            raise click.ClickException("%s answered %s" % (path, response.status))
+        results[name] = {'path': path, 'bytes': len(response.get_data()), 'cold': measure(cold, repeat), 'warm': measure(warm, repeat)}
+        print "%-44s %8.2f ms  cached %.2f ms" % (name, results[name]['cold']['median'] * 1000, results[name]['warm']['median'] * 1000)
+    return results
+
+
+@click.command(help="Benchmark harvesting, searching and serving a synthetic catalog")
+@click.option('--instances', type=int, default=200, help='Number of Galaxy instances')
+@click.option('--tools', type=int, default=20000, help='Number of distinct tools')
+@click.option('--versions', type=int, default=100000, help='Number of distinct tool versions')
+@click.option('--operations', type=int, default=200, help='Number of EDAM operations')
+@click.option('--seed', type=int, default=0, help='Seed of the synthetic catalog')
+@click.option('--payloads', type=click.Path(exists=True, file_okay=False), default=None, help='Replay recorded payloads (see fake_galaxy.py) instead of a synthetic catalog')
+@click.option('--edam-dump', type=click.Path(exists=True, dir_okay=False), default=None, help='EDAM.tsv or EDAM.owl file, to replay recorded payloads without querying OLS')
+@click.option('--database', default=None, help='SQLAlchemy URL of a scratch database, a temporary SQLite file by default')
+@click.option('--reset', is_flag=True, help='Drop the catalog found in --database')
+@click.option('--repeat', type=int, default=5, help='Number of runs of each search and route')
+@click.option('--workers', type=int, default=None, help='Number of instances harvested at once')
+@click.option('--output', type=click.File('w'), default=None, help='JSON file to write the results to')
+def main(instances, tools, versions, operations, seed, payloads, edam_dump, database, reset, repeat, workers, output):
+
+    temporary_directory = None
+    if database is None:
+        temporary_directory = tempfile.mkdtemp(prefix='galaxycat-bench-')
+        database = 'sqlite:///%s' % os.path.join(temporary_directory, 'catalog.sqlite')
+
+    if payloads is not None:
+        catalog = load_payloads(payloads)
+        tools = versions = operations = None
+    else:
+        catalog = generate_catalog(instances=instances, tools=tools, versions=versions, operations=operations, seed=seed)
+    server = FakeGalaxyServer(catalog).start()
+
+    try:
+        create_catalog(database, reset)
+        db.session.add_all(Instance(url=server.url(name)) for name in sorted(catalog))
+        db.session.add_all(EDAMOperation(operation_id=unicode(operation_id(index)), iri=u'http://edamontology.org/%s' % operation_id(index),
+                                         label=unicode(operation_label(index))) for index in range(operations or 0))
+        db.session.commit()
+        # no location lookups, every instance runs on the same host
+        geo_cache.add('127.0.0.1', {'city': u'Localhost', 'country': u'Nowhere', 'countryCode': u'XX', 'lat': 0.0, 'lon': 0.0})
+        if workers is not None:
+            app.config['HARVEST_WORKERS'] = workers
+
+        results = {'harvest': {}}
+        results['harvest']['initial'] = harvest('initial', edam_dump)
+        results['harvest']['unchanged'] = harvest('unchanged', edam_dump)
+        server.update(bump_versions(catalog, seed=seed + 1))
+        results['harvest']['changed'] = harvest('10% of the instances changed', edam_dump)
+
+        results['availability_index'] = measure(load_availability_index, repeat)
+        print "%-44s %8.2f ms" % ('build the availability index', results['availability_index']['median'] * 1000)
+        results['version_drift'] = measure(load_version_drift, repeat)
+        print "%-44s %8.2f ms" % ('compute the version drift', results['version_drift']['median'] * 1000)
+
+        queries = search_queries(catalog)
+        results['search'] = bench_search(queries, repeat)
+        results['routes'] = bench_routes(queries, repeat)
+
+        report = {'galaxycat': __version__,
+                  'python': platform.python_version(),
+                  'sqlalchemy': sqlalchemy.__version__,
+                  'database': db.engine.dialect.name,
+                  'search_backend': app.config['SEARCH_BACKEND'],
+                  'parameters': {'instances': len(catalog), 'tools': tools, 'versions': versions, 'operations': operations,
+                                 'seed': seed, 'payloads': payloads, 'repeat': repeat},
+                  'results': results}
+        if output is not None:
+            json.dump(report, output, indent=2, sort_keys=True)
+    finally:
+        server.shutdown()
+        db.session.remove()
+        if temporary_directory is not None:
+            shutil.rmtree(temporary_directory)
+
+
+if __name__ == '__main__':
+    main()
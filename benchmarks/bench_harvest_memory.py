@@ -0,0 +1,119 @@
+# coding=utf-8
+
+""" Harvests a single synthetic instance of growing size and reports the peak memory of the harvest
+
+    $ python benchmarks/bench_harvest_memory.py
+    $ python benchmarks/bench_harvest_memory.py --sizes=10000,100000,400000 --no-streaming
+
+The fake Galaxy server and every harvest run in their own process, so that the peak resident
+set size of a harvest only accounts for downloading, parsing and storing the tool list.
+"""
+
+import click
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+from fake_galaxy import FakeGalaxyServer
+from galaxycat import toolindex
+from galaxycat.app import app, db
+from galaxycat.catalog import EDAMOperation, Instance, Tool, ToolVersion, geo_cache
+from galaxycat.instrument import HarvestStats
+from synthetic import generate_catalog, operation_id, operation_label
+
+from bench_catalog import create_catalog
+
+
+def peak_memory():
+    """ Peak resident set size of the current process, in MiB """
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 1024.0 / 1024.0 if sys.platform == 'darwin' else peak / 1024.0
+
+
+OPERATIONS = 200
+
+
+def serve(elements, seed, queue):
+
+    catalog = generate_catalog(instances=1, tools=max(1, elements // 5), versions=elements, operations=OPERATIONS, seed=seed)
+    server = FakeGalaxyServer(catalog)
+    name = sorted(catalog)[0]
+    queue.put((server.url(name), len(catalog[name][1]), len(server.get_body(name, 'tools'))))
+    server.serve_forever()
+
+
+def harvest(url, streaming, chunk_size, queue):
+
+    temporary_directory = tempfile.mkdtemp(prefix='galaxycat-bench-')
+    try:
+        create_catalog('sqlite:///%s' % os.path.join(temporary_directory, 'catalog.sqlite'), reset=True)
+        db.session.add(Instance(url=url))
+        db.session.add_all(EDAMOperation(operation_id=unicode(operation_id(index)), iri=u'http://edamontology.org/%s' % operation_id(index),
+                                         label=unicode(operation_label(index))) for index in range(OPERATIONS))
+        db.session.commit()
+        geo_cache.add('127.0.0.1', {'city': u'Localhost', 'country': u'Nowhere', 'countryCode': u'XX', 'lat': 0.0, 'lon': 0.0})
+        if not streaming:
+            toolindex.ijson = None
+        if chunk_size is not None:
+            app.config['HARVEST_CHUNK_SIZE'] = chunk_size
+
+        baseline = peak_memory()
+        start = time.time()
+        Tool.update_catalog(stats=HarvestStats(db.engine))
+        duration = time.time() - start
+        queue.put({'baseline': baseline, 'peak': peak_memory(), 'duration': duration,
+                   'tools': Tool.query.count(), 'versions': ToolVersion.query.count()})
+    finally:
+        db.session.remove()
+        shutil.rmtree(temporary_directory)
+
+
+def run(target, *args):
+    """ Returns what ``target`` puts in its queue, ``target`` runs in a child process """
+
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=target, args=args + (queue,))
+    process.daemon = True
+    process.start()
+    return process, queue.get()
+
+
+@click.command(help="Report the peak memory of harvesting a single large instance")
+@click.option('--sizes', default='10000,50000,200000', help='Comma separated numbers of tool elements of the instance')
+@click.option('--seed', type=int, default=0, help='Seed of the synthetic instances')
+@click.option('--no-streaming', is_flag=True, help='Parse tool lists with json instead of ijson')
+@click.option('--chunk-size', type=int, default=None, help='Tools written to the database at once (HARVEST_CHUNK_SIZE)')
+@click.option('--output', type=click.File('w'), default=None, help='JSON file to write the results to')
+def main(sizes, seed, no_streaming, chunk_size, output):
+
+    streaming = toolindex.ijson is not None and not no_streaming
+    print "parser: %s, chunk size: %s" % ('ijson' if streaming else 'json', chunk_size or app.config['HARVEST_CHUNK_SIZE'])
+
+    results = []
+    for size in [int(size) for size in sizes.split(',')]:
+        server, (url, elements, payload) = run(serve, size, seed)
+        try:
+            worker, result = run(harvest, url, streaming, chunk_size)
+            worker.join()
+        finally:
+            server.terminate()
+        result.update({'elements': elements, 'payload': payload})
+        results.append(result)
+        print "%8d elements %8.1f MiB payload %8.1f MiB peak (+%.1f MiB)  %7.2f s  %d tools %d versions" % (
+            elements, payload / 1024.0 / 1024.0, result['peak'], result['peak'] - result['baseline'], result['duration'],
+            result['tools'], result['versions'])
+
+    if output is not None:
+        json.dump({'streaming': streaming, 'chunk_size': chunk_size or app.config['HARVEST_CHUNK_SIZE'], 'results': results},
+                  output, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+# coding=utf-8
+
+""" Times how long the CLI and the webapp take to start, and checks them against a budget
+
+    $ python benchmarks/bench_import_time.py
+    $ python benchmarks/bench_import_time.py --runs=21 --output=import_time.json
+
+Each statement runs in a fresh interpreter, as a command does, and is timed from the
+start to the exit of the process. Python 2 has no ``-X importtime``, so the heavy
+dependencies loaded by each statement are listed instead: a command which loads
+one it does not need, bioblend for a command which does not harvest for instance,
+fails the budget of ``import_budget.json`` whatever the timings.
+
+The statements run in a temporary directory whose ``app.cfg`` points at an empty
+SQLite catalog, created by the ``create_database`` statement, so that real commands
+run end to end without touching the catalog of the repository.
+"""
+
+import click
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+
+STATEMENTS = [('galaxycat --help', 'from galaxycat.cli import cli; cli(["--help"])'),
+              ('import galaxycat.cli', 'import galaxycat.cli'),
+              ('import galaxycat.app', 'import galaxycat.app'),
+              ('import galaxycat.harvest', 'import galaxycat.app; import galaxycat.harvest'),
+              # create_database creates the catalog searched by the next statement
+              ('galaxycat create_database', 'from galaxycat.cli import cli; cli(["create_database"])'),
+              ('galaxycat search', 'from galaxycat.cli import cli; cli(["search", "--search", "samtools"])')]
+
+REPOSITORY_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ['bioblend', 'flask', 'flask_sqlalchemy', 'ijson', 'pyparsing', 'requests', 'sqlalchemy']
+
+PROBE = """
+import json, sys
+try:
+    %s
+except SystemExit:
+    pass
+print
+print json.dumps(sorted(module for module in %r if module in sys.modules))
+"""
+
+
+def run_statement(statement, cwd=None):
+    """ Seconds taken by a fresh interpreter to run ``statement`` in ``cwd`` """
+
+    with open(os.devnull, 'w') as devnull:
+        start = time.time()
+        subprocess.check_call([sys.executable, '-c', statement], stdout=devnull, cwd=cwd)
+        return time.time() - start
+
+
+def loaded_modules(statement, cwd=None):
+    """ HEAVY_MODULES loaded by a fresh interpreter running ``statement`` in ``cwd`` """
+
+    output = subprocess.check_output([sys.executable, '-c', PROBE % (statement, HEAVY_MODULES)], cwd=cwd)
+    return json.loads(output.splitlines()[-1])
+
+
+def create_workdir():
+    """ Temporary directory whose app.cfg points at a SQLite catalog of its own """
+
+    workdir = tempfile.mkdtemp(prefix='galaxycat-import-time-')
+    with open(os.path.join(workdir, 'app.cfg'), 'w') as config:
+        config.write("SQLALCHEMY_DATABASE_URI = %r\n" % ('sqlite:///%s' % os.path.join(workdir, 'catalog.sqlite')))
+    return workdir
+
+
+def median(values):
+
+    values = sorted(values)
+    middle = len(values) // 2
+    return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2.0
+
+
+def check_budget(name, result, budget):
+    """ Returns the reasons why ``result`` is over ``budget`` """
+
+    failures = []
+    if 'seconds' in budget and result['median'] > budget['seconds']:
+        failures.append("%s: %.0f ms, the budget is %.0f ms" % (name, result['median'] * 1000, budget['seconds'] * 1000))
+    for module in sorted(set(result['modules']) & set(budget.get('forbidden', []))):
+        failures.append("%s: loads %s" % (name, module))
+    return failures
+
+
+@click.command(help="Time the startup of the CLI and the webapp against a budget")
+@click.option('--runs', type=int, default=11, help='Fresh interpreters started for each statement')
+@click.option('--budget', type=click.File('r'), default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'import_budget.json'),
+              help='JSON file of the budget of each statement')
+@click.option('--output', type=click.File('w'), default=None, help='JSON file to write the results to')
+def main(runs, budget, output):
+
+    budget = json.load(budget)
+    interpreter = run_statement('pass')
+    print "%-26s %8.1f ms" % ("bare interpreter", interpreter * 1000)
+
+    results = {}
+    failures = []
+    workdir = create_workdir()
+    # the statements import the galaxycat package of this repository, wherever they run
+    os.environ['PYTHONPATH'] = os.pathsep.join([REPOSITORY_DIR] + filter(None, [os.environ.get('PYTHONPATH', None)]))
+    try:
+        for name, statement in STATEMENTS:
+            timings = [run_statement(statement, cwd=workdir) for run in range(runs)]
+            results[name] = {'median': median(timings), 'min': min(timings), 'max': max(timings),
+                             'modules': loaded_modules(statement, cwd=workdir)}
+            print "%-26s %8.1f ms  (min %.1f, max %.1f)  %s" % (name, results[name]['median'] * 1000, results[name]['min'] * 1000,
+                                                              results[name]['max'] * 1000, ', '.join(results[name]['modules']) or '-')
+            if name in budget:
+                failures.extend(check_budget(name, results[name], budget[name]))
+    finally:
+        shutil.rmtree(workdir)
+
+    if output is not None:
+        json.dump({'python': sys.version.split()[0], 'runs': runs, 'interpreter': interpreter, 'results': results},
+                  output, indent=2, sort_keys=True)
+
+    for failure in failures:
+        print "Over budget: %s" % failure
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
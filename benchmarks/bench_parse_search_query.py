@@ -0,0 +1,38 @@
+# coding=utf-8
+
+""" Compares the latency of parse_search_query with a grammar rebuilt on every call and with the cached grammar
+
+    $ python benchmarks/bench_parse_search_query.py
+"""
+
+import timeit
+
+from galaxycat.app import app  # NOQA, must be imported before the models
+from galaxycat.catalog import build_search_grammar, parse_search_query, parsed_search_queries
+
+QUERIES = [u'samtools', u'bed', u'topic:conversion', u'"bam to bed" instance:galaxeast', u'fastq topic:"sequence trimming"']
+
+
+def rebuild_every_call():
+    for query in QUERIES:
+        build_search_grammar().parseString(query)
+
+
+def cached_grammar():
+    parsed_search_queries.clear()
+    for query in QUERIES:
+        parse_search_query(query)
+
+
+def cached_parse_tree():
+    for query in QUERIES:
+        parse_search_query(query)
+
+
+if __name__ == '__main__':
+    for name, function, number in (('grammar rebuilt on every call', rebuild_every_call, 10),
+                                   ('cached grammar', cached_grammar, 1000),
+                                   ('cached grammar and parse tree', cached_parse_tree, 100000)):
+        function()  # warm up
+        seconds = min(timeit.repeat(function, number=number, repeat=3)) / number / len(QUERIES)
+        print "%-32s %10.1f us/query" % (name, seconds * 1e6)
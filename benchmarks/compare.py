@@ -0,0 +1,49 @@
+# coding=utf-8
+
+""" Compares two JSON reports of bench_catalog.py
+
+    $ python benchmarks/compare.py before.json after.json
+"""
+
+import click
+import json
+
+
+def timings(report):
+    """ Flattens a report into {name: seconds} """
+
+    results = report['results']
+    flat = {}
+    for name, harvest in results['harvest'].iteritems():
+        flat['harvest %s' % name] = harvest['duration']
+    for name, search in results['search'].iteritems():
+        flat['search %s' % name] = search['median']
+    for name, route in results['routes'].iteritems():
+        flat['%s' % name] = route['cold']['median']
+        flat['%s (cached)' % name] = route['warm']['median']
+    if 'availability_index' in results:
+        flat['build the availability index'] = results['availability_index']['median']
+    if 'version_drift' in results:
+        flat['compute the version drift'] = results['version_drift']['median']
+    return flat
+
+
+@click.command(help="Compare two benchmark reports")
+@click.argument('before', type=click.File('r'))
+@click.argument('after', type=click.File('r'))
+def main(before, after):
+    before = json.load(before)
+    after = json.load(after)
+    if before['parameters'] != after['parameters']:
+        print "Warning: the reports were run with different parameters"
+
+    before_timings = timings(before)
+    after_timings = timings(after)
+    print "%-52s %12s %12s %8s" % ('', 'before (ms)', 'after (ms)', 'ratio')
+    for name in sorted(set(before_timings) & set(after_timings)):
+        ratio = after_timings[name] / before_timings[name] if before_timings[name] else float('nan')
+        print "%-52s %12.2f %12.2f %7.2fx" % (name, before_timings[name] * 1000, after_timings[name] * 1000, ratio)
+
+
+if __name__ == '__main__':
+    main()
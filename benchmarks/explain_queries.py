@@ -0,0 +1,83 @@
+# coding=utf-8
+
+""" Prints the query plans of the hot lookups of GalaxyCat, to check which indexes they use
+
+Run it on a catalog harvested by bench_catalog.py :
+
+    $ python benchmarks/bench_catalog.py --instances=20 --tools=2000 --versions=10000 --database=sqlite:///bench.sqlite
+    $ python benchmarks/explain_queries.py --database=sqlite:///bench.sqlite
+"""
+
+import click
+
+from galaxycat.app import app, db
+from galaxycat.catalog import EDAMOperation, Instance, Tool, ToolVersion, tool_edam_operation, toolversion_instance
+from sqlalchemy import func, select
+
+
+def compile_query(query):
+
+    if hasattr(query, 'statement'):
+        query = query.statement
+    return unicode(query.compile(dialect=db.engine.dialect, compile_kwargs={'literal_binds': True}))
+
+
+def hot_queries():
+    """ Returns [(name, query)], parameters come from the catalog itself """
+
+    brand = db.session.query(Instance.brand)\
+        .join(toolversion_instance, toolversion_instance.c.instance_id == Instance.id)\
+        .group_by(Instance.brand)\
+        .order_by(func.count().desc())\
+        .limit(1).scalar()
+    label = db.session.query(EDAMOperation.label)\
+        .join(tool_edam_operation)\
+        .limit(1).scalar()
+    shed_version = ToolVersion.query.filter(ToolVersion.changeset.isnot(None)).first()
+    tool_version = ToolVersion.query.first()
+    instance_id = db.session.query(func.min(Instance.id)).scalar()
+    version_table = ToolVersion.__table__
+
+    return [('search instance:%s' % brand, Tool.search_query(u'instance:%s' % brand)),
+            ('search topic:"%s"' % label, Tool.search_query(u'topic:"%s"' % label)),
+            ('search %s' % tool_version.name, Tool.search_query(tool_version.name)),
+            ('tool version by tool shed key',
+             select([version_table.c.id]).where((version_table.c.name == shed_version.name) &
+                                                (version_table.c.changeset == shed_version.changeset) &
+                                                (version_table.c.tool_shed == shed_version.tool_shed) &
+                                                (version_table.c.owner == shed_version.owner))),
+            ('tool version by name and version',
+             select([version_table.c.id]).where((version_table.c.name == tool_version.name) & (version_table.c.version == tool_version.version))),
+            ('versions of a tool', select([func.count(version_table.c.id)]).where(version_table.c.tool_id == tool_version.tool_id)),
+            ('links of an instance', select([toolversion_instance.c.tool_version_id]).where(toolversion_instance.c.instance_id == instance_id)),
+            ('links of a tool version', select([toolversion_instance.c.instance_id]).where(toolversion_instance.c.tool_version_id == tool_version.id)),
+            ('tools by topic', select([tool_edam_operation.c.tool_id]).where(tool_edam_operation.c.edam_operation_id == u'operation_1000')),
+            ('tools count of every instance', select([toolversion_instance.c.instance_id, func.count(ToolVersion.tool_id.distinct())])
+             .select_from(toolversion_instance.join(version_table))
+             .group_by(toolversion_instance.c.instance_id))]
+
+
+@click.command(help="Print the query plans of the hot lookups")
+@click.option('--database', required=True, help='SQLAlchemy URL of a harvested catalog')
+@click.option('--analyze', is_flag=True, help='Run the queries (EXPLAIN ANALYZE, PostgreSQL only)')
+def main(database, analyze):
+
+    app.config['SQLALCHEMY_DATABASE_URI'] = database
+    if db.engine.dialect.name == 'sqlite':
+        explain = 'EXPLAIN QUERY PLAN '
+    elif analyze:
+        explain = 'EXPLAIN ANALYZE '
+    else:
+        explain = 'EXPLAIN '
+
+    for name, query in hot_queries():
+        sql = compile_query(query)
+        print '-- %s' % name
+        print sql
+        for row in db.session.execute(explain + sql):
+            print '   ', ' | '.join(unicode(value) for value in row)
+        print
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+# coding=utf-8
+
+""" A local HTTP server answering the Galaxy API calls made while harvesting, with synthetic or recorded payloads
+
+Instances are served under http://127.0.0.1:<port>/<name>/. A directory of recorded payloads holds
+one ``<name>.json`` file per instance, the output of ``ToolClient(galaxy_instance).get_tools()``, and
+optionally a ``<name>.config.json`` file, the output of ``galaxy_instance.config.get_config()`` :
+
+    $ python benchmarks/fake_galaxy.py --payloads=payloads/ --port=8080
+
+With ``--failures=N``, the first N requests of each resource are answered with a 503, to check that
+the harvest retries them, and ``--gzip`` compresses the bodies for the clients which accept it.
+"""
+
+import click
+import json
+import os
+import threading
+import time
+import zlib
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+
+def make_config(name):
+
+    return {'allow_user_creation': True,
+            'brand': name,
+            'enable_quotas': False,
+            'require_login': False,
+            'terms_url': None,
+            'version_major': '17.09'}
+
+
+def load_payloads(directory):
+    """ Returns {name: (configuration, tools)} from a directory of recorded payloads """
+
+    instances = {}
+    for filename in sorted(os.listdir(directory)):
+        if filename.endswith('.json') and not filename.endswith('.config.json'):
+            name = filename[:-len('.json')]
+            with open(os.path.join(directory, filename)) as payload:
+                tools = json.load(payload)
+            config_path = os.path.join(directory, '%s.config.json' % name)
+            if os.path.exists(config_path):
+                with open(config_path) as payload:
+                    config = json.load(payload)
+            else:
+                config = make_config(name)
+            instances[name] = (config, tools)
+    return instances
+
+
+class FakeGalaxyHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        parts = self.path.split('?')[0].strip('/').split('/')
+        instance = self.server.instances.get(parts[0], None)
+        if instance is None or len(parts) != 3 or parts[1] != 'api' or parts[2] not in ('configuration', 'tools'):
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        if self.server.delay:
+            time.sleep(self.server.delay)
+
+        if self.server.fail(parts[0], parts[2]):
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        body = self.server.get_body(parts[0], parts[2])
+        etag = '"%x"' % (zlib.crc32(body) & 0xffffffff)
+        if self.headers.get('If-None-Match', None) == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        if self.server.gzip and 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = self.server.get_body(parts[0], parts[2], compressed=True)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeGalaxyServer(ThreadingMixIn, HTTPServer):
+    """ Serves ``instances``, a dict of {name: (configuration, tools)}, bodies are encoded once and kept in memory """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, instances, port=0, delay=0, failures=0, gzip=False):
+        HTTPServer.__init__(self, ('127.0.0.1', port), FakeGalaxyHandler)
+        self.delay = delay
+        self.failures = failures
+        self.gzip = gzip
+        self.requests = {}  # (name, resource): number of requests received
+        self.bodies = {}
+        self.lock = threading.Lock()
+        self.instances = {}
+        self.update(instances)
+
+    def update(self, instances):
+        """ Replace the payloads of some instances, e.g. to simulate a new tool version """
+
+        with self.lock:
+            self.instances.update(instances)
+            for name in instances:
+                for resource in ('configuration', 'tools'):
+                    self.bodies.pop((name, resource), None)
+                    self.bodies.pop((name, resource, 'gzip'), None)
+
+    def fail(self, name, resource):
+        """ Whether this request is one of the first ``failures`` requests of the resource """
+
+        with self.lock:
+            count = self.requests.get((name, resource), 0)
+            self.requests[(name, resource)] = count + 1
+        return count < self.failures
+
+    def get_body(self, name, resource, compressed=False):
+        with self.lock:
+            body = self.bodies.get((name, resource), None)
+            if body is None:
+                config, tools = self.instances[name]
+                body = json.dumps(config if resource == 'configuration' else tools)
+                self.bodies[(name, resource)] = body
+            if compressed:
+                plain, body = body, self.bodies.get((name, resource, 'gzip'), None)
+                if body is None:
+                    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+                    body = compressor.compress(plain) + compressor.flush()
+                    self.bodies[(name, resource, 'gzip')] = body
+        return body
+
+    def url(self, name):
+        return u'http://127.0.0.1:%d/%s/' % (self.server_address[1], name)
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+
+@click.command(help="Serve recorded Galaxy payloads")
+@click.option('--payloads', type=click.Path(exists=True, file_okay=False), required=True, help='Directory of recorded payloads')
+@click.option('--port', type=int, default=8080, help='Port to listen to')
+@click.option('--delay', type=float, default=0, help='Seconds to wait before answering each request')
+@click.option('--failures', type=int, default=0, help='Requests of each resource answered with a 503 before the payload')
+@click.option('--gzip', is_flag=True, help='Compress the bodies for the clients which accept gzip')
+def main(payloads, port, delay, failures, gzip):
+    server = FakeGalaxyServer(load_payloads(payloads), port=port, delay=delay, failures=failures, gzip=gzip)
+    for name in sorted(server.instances):
+        print server.url(name)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
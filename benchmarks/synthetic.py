@@ -0,0 +1,95 @@
+# coding=utf-8
+
+""" Deterministic synthetic Galaxy instances, the same seed always gives the same catalog """
+
+import random
+
+from fake_galaxy import make_config
+
+
+TOOL_SHED = 'toolshed.g2.bx.psu.edu'
+OWNERS = ['iuc', 'devteam', 'bgruening', 'galaxyp', 'nml', 'lparsons', 'pjbriggs', 'rnateam']
+
+# words of known frequency in the tool descriptions, to search with a known selectivity
+SELECTIVE_WORDS = [('alignment', 0.5), ('variant', 0.05), ('phylogeny', 0.005)]
+FILLER_WORDS = ['w%d' % index for index in range(2000)]
+
+
+def operation_id(index):
+    return 'operation_%04d' % (1000 + index)
+
+
+def operation_label(index):
+    return 'Operation %d' % index
+
+
+def instance_name(index):
+    return 'galaxy%d' % index
+
+
+def generate_catalog(instances=200, tools=20000, versions=100000, operations=200, seed=0):
+    """
+    Returns {instance name: (configuration, tools)}, the tools being the elements returned by ToolClient.get_tools().
+
+    Every tool has versions/tools versions on average, every version is available on
+    a Pareto distributed number of instances (at least one), so a few tools are
+    installed almost everywhere while most are installed on a handful of instances.
+    """
+
+    rng = random.Random(seed)
+    payloads = dict((instance_name(index), []) for index in range(instances))
+    names = sorted(payloads)
+    average_versions = float(versions) / tools
+
+    for tool_index in xrange(tools):
+        tool_name = 'tool%d' % tool_index
+        owner = rng.choice(OWNERS)
+        local = rng.random() < 0.05
+        words = [word for word, frequency in SELECTIVE_WORDS if rng.random() < frequency]
+        words.extend(rng.sample(FILLER_WORDS, 6))
+        rng.shuffle(words)
+        tool_operations = [operation_id(index) for index in rng.sample(xrange(operations), rng.choice([0, 0, 1, 1, 2]))]
+        versions_count = max(1, int(round(rng.expovariate(1.0 / average_versions))))
+
+        for version_index in xrange(versions_count):
+            version = '%d.%d.%d' % (1 + version_index // 10, version_index % 10, rng.randrange(3))
+            element = {'model_class': 'Tool',
+                       'name': 'Tool %d' % tool_index,
+                       'description': ' '.join(words),
+                       'version': version,
+                       'edam_operations': tool_operations,
+                       'panel_section_id': 'section%d' % (tool_index % 40)}
+            if local:
+                element['id'] = tool_name
+                element['link'] = '/tool_runner?tool_id=%s' % tool_name
+            else:
+                element['id'] = '%s/repos/%s/%s/%s/%s' % (TOOL_SHED, owner, tool_name, tool_name, version)
+                element['link'] = '/tool_runner?tool_id=%s' % element['id']
+                element['tool_shed_repository'] = {'changeset_revision': '%012x' % rng.getrandbits(48),
+                                                   'name': tool_name,
+                                                   'owner': owner,
+                                                   'tool_shed': TOOL_SHED}
+
+            copies = min(instances, int(rng.paretovariate(1.5)))
+            for name in rng.sample(names, copies):
+                payloads[name].append(element)
+
+    return dict((name, (make_config(name), tools)) for name, tools in payloads.iteritems())
+
+
+def bump_versions(catalog, fraction=0.1, seed=1):
+    """ Returns the payloads of ``fraction`` of the instances of ``catalog`` with a new version of 1% of their tools """
+
+    rng = random.Random(seed)
+    changed = {}
+    for name in rng.sample(sorted(catalog), max(1, int(len(catalog) * fraction))):
+        config, tools = catalog[name]
+        tools = list(tools)
+        for index in rng.sample(xrange(len(tools)), min(len(tools), max(1, len(tools) // 100))):
+            element = dict(tools[index])
+            element['version'] += '+bench'
+            if 'tool_shed_repository' in element:
+                element['tool_shed_repository'] = dict(element['tool_shed_repository'], changeset_revision='%012x' % rng.getrandbits(48))
+            tools[index] = element
+        changed[name] = (config, tools)
+    return changed
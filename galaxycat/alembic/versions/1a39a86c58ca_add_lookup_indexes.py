@@ -0,0 +1,62 @@
+"""Add lookup indexes and association keys
+
+Revision ID: 1a39a86c58ca
+Revises: 5b2d7e61c0a3
+Create Date: 2026-10-18 13:41:09.271845
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1a39a86c58ca'
+down_revision = '5b2d7e61c0a3'
+branch_labels = None
+depends_on = None
+
+# (table, columns of the primary key with their types)
+ASSOCIATIONS = [('toolversion_instance', [('tool_version_id', sa.Integer()), ('instance_id', sa.Integer())]),
+                ('tool_edam_operation', [('tool_id', sa.Integer()), ('edam_operation_id', sa.Unicode())])]
+
+
+def remove_duplicate_links(table, left, right):
+    op.execute('DELETE FROM %s WHERE %s IS NULL OR %s IS NULL' % (table, left, right))
+    op.execute('CREATE TABLE %s_distinct AS SELECT DISTINCT %s, %s FROM %s' % (table, left, right, table))
+    op.execute('DELETE FROM %s' % table)
+    op.execute('INSERT INTO %s (%s, %s) SELECT %s, %s FROM %s_distinct' % (table, left, right, left, right, table))
+    op.execute('DROP TABLE %s_distinct' % table)
+
+
+def upgrade():
+    # links are unique, the second column of the key gets its own index
+    for table, columns in ASSOCIATIONS:
+        (left, left_type), (right, right_type) = columns
+        remove_duplicate_links(table, left, right)
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.alter_column(left, existing_type=left_type, nullable=False)
+            batch_op.alter_column(right, existing_type=right_type, nullable=False)
+            batch_op.create_primary_key('pk_%s' % table, [left, right])
+        op.create_index(op.f('ix_%s_%s' % (table, right)), table, [right], unique=False)
+
+    op.create_index('ix_tool_version_tool_shed_key', 'tool_version', ['name', 'changeset', 'tool_shed', 'owner'], unique=False)
+    op.create_index('ix_tool_version_local_key', 'tool_version', ['name', 'version'], unique=False)
+    op.create_index(op.f('ix_tool_version_tool_id'), 'tool_version', ['tool_id'], unique=False)
+    op.create_index('ix_instance_lower_brand', 'instance', [sa.text('lower(brand)')], unique=False)
+    op.create_index('ix_edam_operation_lower_label', 'edam_operation', [sa.text('lower(label)')], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_edam_operation_lower_label', table_name='edam_operation')
+    op.drop_index('ix_instance_lower_brand', table_name='instance')
+    op.drop_index(op.f('ix_tool_version_tool_id'), table_name='tool_version')
+    op.drop_index('ix_tool_version_local_key', table_name='tool_version')
+    op.drop_index('ix_tool_version_tool_shed_key', table_name='tool_version')
+
+    for table, columns in reversed(ASSOCIATIONS):
+        (left, left_type), (right, right_type) = columns
+        op.drop_index(op.f('ix_%s_%s' % (table, right)), table_name=table)
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_constraint('pk_%s' % table, type_='primary')
+            batch_op.alter_column(left, existing_type=left_type, nullable=True)
+            batch_op.alter_column(right, existing_type=right_type, nullable=True)
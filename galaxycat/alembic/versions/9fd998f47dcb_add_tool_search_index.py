@@ -0,0 +1,37 @@
+"""Add tool full-text search index
+
+Revision ID: 9fd998f47dcb
+Revises: 4fc80d2ce0e4
+Create Date: 2026-10-18 12:11:58.214503
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '9fd998f47dcb'
+down_revision = '4fc80d2ce0e4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.execute('CREATE TABLE tool_search ('
+                   'tool_id INTEGER PRIMARY KEY REFERENCES tool (id) ON DELETE CASCADE, '
+                   'document TSVECTOR NOT NULL)')
+        op.execute('CREATE INDEX ix_tool_search_document ON tool_search USING gin (document)')
+        op.execute("INSERT INTO tool_search (tool_id, document) "
+                   "SELECT id, setweight(to_tsvector('simple', coalesce(name, '')), 'A') || "
+                   "setweight(to_tsvector('simple', coalesce(display_name, '')), 'A') || "
+                   "setweight(to_tsvector('simple', coalesce(description, '')), 'B') FROM tool")
+    elif dialect == 'sqlite':
+        op.execute('CREATE VIRTUAL TABLE tool_search USING fts5(name, display_name, description)')
+        op.execute("INSERT INTO tool_search (rowid, name, display_name, description) "
+                   "SELECT id, name, coalesce(display_name, ''), coalesce(description, '') FROM tool")
+
+
+def downgrade():
+    if op.get_bind().dialect.name in ('postgresql', 'sqlite'):
+        op.execute('DROP TABLE tool_search')
@@ -0,0 +1,42 @@
+"""Add the EDAM operations of the tools per instance
+
+Revision ID: b41e8d2c6f90
+Revises: 7c2f4e9a1d53
+Create Date: 2026-10-18 17:02:45.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b41e8d2c6f90'
+down_revision = '7c2f4e9a1d53'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('tool_edam_operation_instance',
+                    sa.Column('tool_id', sa.Integer(), nullable=False),
+                    sa.Column('edam_operation_id', sa.Unicode(), nullable=False),
+                    sa.Column('instance_id', sa.Integer(), nullable=False),
+                    sa.ForeignKeyConstraint(['edam_operation_id'], ['edam_operation.operation_id'], ),
+                    sa.ForeignKeyConstraint(['instance_id'], ['instance.id'], ),
+                    sa.ForeignKeyConstraint(['tool_id'], ['tool.id'], ),
+                    sa.PrimaryKeyConstraint('tool_id', 'edam_operation_id', 'instance_id', name='pk_tool_edam_operation_instance'))
+    op.create_index(op.f('ix_tool_edam_operation_instance_instance_id'), 'tool_edam_operation_instance', ['instance_id'], unique=False)
+
+    # which instance annotates a tool with which operation is unknown, every instance providing a tool is
+    # assumed to annotate it with all its operations until the next harvest reads the tool lists again
+    op.execute('INSERT INTO tool_edam_operation_instance (tool_id, edam_operation_id, instance_id) '
+               'SELECT DISTINCT tool_edam_operation.tool_id, tool_edam_operation.edam_operation_id, toolversion_instance.instance_id '
+               'FROM tool_edam_operation '
+               'JOIN tool_version ON tool_version.tool_id = tool_edam_operation.tool_id '
+               'JOIN toolversion_instance ON toolversion_instance.tool_version_id = tool_version.id')
+    op.execute('UPDATE instance SET tools_fingerprint = NULL, tools_etag = NULL, tools_last_modified = NULL')
+
+
+def downgrade():
+    op.drop_index(op.f('ix_tool_edam_operation_instance_instance_id'), table_name='tool_edam_operation_instance')
+    op.drop_table('tool_edam_operation_instance')
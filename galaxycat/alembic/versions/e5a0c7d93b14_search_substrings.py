@@ -0,0 +1,52 @@
+"""Search substrings of the tools
+
+Revision ID: e5a0c7d93b14
+Revises: b41e8d2c6f90
+Create Date: 2026-10-18 17:48:21.530917
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5a0c7d93b14'
+down_revision = 'b41e8d2c6f90'
+branch_labels = None
+depends_on = None
+
+SEARCH_COLUMNS = ('name', 'display_name', 'description')
+
+
+def sqlite_supports_trigrams():
+    version = op.get_bind().execute('SELECT sqlite_version()').scalar()
+    return tuple(int(part) for part in version.split('.')) >= (3, 34)
+
+
+def fill_sqlite_index():
+    op.execute("INSERT INTO tool_search (rowid, name, display_name, description) "
+               "SELECT id, name, coalesce(display_name, ''), coalesce(description, '') FROM tool")
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        for column in SEARCH_COLUMNS:
+            op.execute('CREATE INDEX ix_tool_%s_trgm ON tool USING gin (%s gin_trgm_ops)' % (column, column))
+    elif dialect == 'sqlite':
+        # without the trigram tokenizer, searches fall back to ILIKE
+        op.execute('DROP TABLE IF EXISTS tool_search')
+        if sqlite_supports_trigrams():
+            op.execute("CREATE VIRTUAL TABLE tool_search USING fts5(name, display_name, description, tokenize='trigram')")
+            fill_sqlite_index()
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        for column in reversed(SEARCH_COLUMNS):
+            op.execute('DROP INDEX ix_tool_%s_trgm' % column)
+    elif dialect == 'sqlite':
+        op.execute('DROP TABLE IF EXISTS tool_search')
+        op.execute('CREATE VIRTUAL TABLE tool_search USING fts5(name, display_name, description)')
+        fill_sqlite_index()
@@ -0,0 +1,54 @@
+"""Add tool version sort key
+
+Revision ID: f3b8d1a6c472
+Revises: e5a0c7d93b14
+Create Date: 2026-10-18 18:36:12.804417
+
+"""
+import re
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3b8d1a6c472'
+down_revision = 'e5a0c7d93b14'
+branch_labels = None
+depends_on = None
+
+
+def version_sort_key(version):
+    # galaxycat.toolindex.version_sort_key() as of this revision
+
+    key = []
+    for number, word in re.findall(r'(\d+)|([a-z]+)', version.lower()):
+        if number:
+            number = number.lstrip('0') or '0'
+            key.append(u'1%02d%s' % (len(number), number))
+        else:
+            key.append(u'2%s' % word)
+    return u''.join(key)
+
+
+def upgrade():
+    op.add_column('tool_version', sa.Column('sort_key', sa.Unicode(), nullable=True))
+
+    connection = op.get_bind()
+    tool_version = sa.table('tool_version', sa.column('id', sa.Integer()), sa.column('version', sa.Unicode()),
+                            sa.column('sort_key', sa.Unicode()))
+    sort_keys = [{'_id': row.id, 'sort_key': version_sort_key(row.version)}
+                 for row in connection.execute(sa.select([tool_version.c.id, tool_version.c.version]))]
+    if sort_keys:
+        connection.execute(tool_version.update()
+                                       .where(tool_version.c.id == sa.bindparam('_id'))
+                                       .values(sort_key=sa.bindparam('sort_key')),
+                           sort_keys)
+
+    # the documents list the versions in the new order once rebuilt
+    op.execute('DELETE FROM tool_document')
+
+
+def downgrade():
+    op.drop_column('tool_version', 'sort_key')
+    op.execute('DELETE FROM tool_document')
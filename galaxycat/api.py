@@ -0,0 +1,198 @@
+# coding=utf-8
+
+""" Read-only JSON API of the catalog """
+
+import json
+import zlib
+
+from flask import Blueprint, Response, abort, current_app, jsonify, request, stream_with_context
+from galaxycat.app import cached_page, db
+from galaxycat.catalog import CatalogStatus, EDAMOperation, Instance, Tool, ToolVersion, toolversion_instance
+from galaxycat.scheduler import harvest_status
+from sqlalchemy import select
+from sqlalchemy.orm import subqueryload, undefer
+
+
+api = Blueprint('api', __name__, url_prefix='/api')
+
+EXPORT_COLUMNS = ['tool', 'version', 'tool_shed', 'owner', 'changeset', 'instance']
+
+
+def get_pagination():
+
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', current_app.config['SEARCH_PER_PAGE'], type=int), 1), current_app.config['SEARCH_MAX_PER_PAGE'])
+    return page, per_page
+
+
+def select_fields(item):
+    """ Keep the fields listed in the ``fields`` argument, e.g. ?fields=name,description """
+
+    fields = request.args.get('fields', None)
+    if not fields:
+        return item
+    fields = fields.split(',')
+    return dict((key, value) for key, value in item.iteritems() if key in fields)
+
+
+def paginated(items, total, page, per_page):
+
+    return jsonify({'items': [select_fields(item) for item in items],
+                    'total': total,
+                    'page': page,
+                    'per_page': per_page})
+
+
+def tool_to_dict(tool):
+    """ Summary of a tool in lists, the details of a tool come from Tool.get_document() """
+
+    return {'id': tool.id,
+            'name': tool.name,
+            'display_name': tool.display_name,
+            'description': tool.description,
+            'link': tool.link,
+            'topics': [edam_operation.label for edam_operation in tool.edam_operations],
+            'versions_count': tool.versions_count}
+
+
+def instance_to_dict(instance, tools_count):
+
+    return {'id': instance.id,
+            'url': instance.url,
+            'brand': instance.brand,
+            'version': instance.version,
+            'location': instance.location,
+            'country_code': instance.country_code,
+            'latitude': instance.latitude,
+            'longitude': instance.longitude,
+            'require_login': instance.require_login,
+            'enable_quotas': instance.enable_quotas,
+            'allow_user_creation': instance.allow_user_creation,
+            'terms_url': instance.terms_url,
+            'update_date': instance.update_date.isoformat() if instance.update_date is not None else None,
+            'last_success_date': instance.last_success_date.isoformat() if instance.last_success_date is not None else None,
+            'last_duration': instance.last_duration,
+            'tools_count': tools_count}
+
+
+@api.route('/search')
+@cached_page
+def search():
+
+    search = request.args.get('search', None)
+    page, per_page = get_pagination()
+    tools = Tool.search(search, limit=per_page, offset=(page - 1) * per_page)
+
+    return paginated([tool_to_dict(tool) for tool in tools], Tool.search_count(search), page, per_page)
+
+
+@api.route('/tools')
+@cached_page
+def tools():
+
+    page, per_page = get_pagination()
+    tools = Tool.query.options(subqueryload(Tool.edam_operations), undefer(Tool.versions_count))\
+                      .order_by(Tool.id)\
+                      .limit(per_page)\
+                      .offset((page - 1) * per_page)
+
+    return paginated([tool_to_dict(tool) for tool in tools], Tool.query.count(), page, per_page)
+
+
+@api.route('/tools/<int:id>')
+@cached_page
+def tool(id):
+
+    tool = Tool.get_document(id)
+    if tool is None:
+        abort(404)
+
+    return jsonify(select_fields(tool))
+
+
+@api.route('/instances')
+@cached_page
+def instances():
+
+    page, per_page = get_pagination()
+    tools_counts = Instance.get_tools_counts()
+    instances = Instance.query.order_by(Instance.id)\
+                              .limit(per_page)\
+                              .offset((page - 1) * per_page)
+
+    return paginated([instance_to_dict(instance, tools_counts.get(instance.id, 0)) for instance in instances], Instance.query.count(), page, per_page)
+
+
+@api.route('/topics')
+@cached_page
+def topics():
+
+    page, per_page = get_pagination()
+    # every topic is counted by a single grouped query, shared with the Topics page
+    tools_counts = EDAMOperation.get_tools_counts()
+    topics = [{'operation_id': topic.operation_id, 'label': topic.label, 'tools_count': topic.tools_count}
+              for topic in tools_counts[(page - 1) * per_page:page * per_page]]
+
+    return paginated(topics, len(tools_counts), page, per_page)
+
+
+@api.route('/harvest')
+def harvest():
+    """ Harvests due, in flight and upcoming, live rather than per catalog generation """
+
+    return jsonify(harvest_status())
+
+
+def iter_export(batch_size=1000):
+    """ Yields the tool/version/instance matrix as NDJSON lines, rows are streamed from the database """
+
+    tool_table = Tool.__table__
+    tool_version_table = ToolVersion.__table__
+    instance_table = Instance.__table__
+    query = select([tool_table.c.name, tool_version_table.c.version, tool_version_table.c.tool_shed,
+                    tool_version_table.c.owner, tool_version_table.c.changeset, instance_table.c.url])\
+        .select_from(tool_table.join(tool_version_table).join(toolversion_instance).join(instance_table))\
+        .order_by(tool_table.c.name, tool_version_table.c.id, instance_table.c.url)
+
+    result = db.session.connection().execution_options(stream_results=True).execute(query)
+    try:
+        while True:
+            rows = result.fetchmany(batch_size)
+            if not rows:
+                break
+            yield ''.join(json.dumps(dict(zip(EXPORT_COLUMNS, row))) + '\n' for row in rows)
+    finally:
+        result.close()
+
+
+def gzip_stream(chunks):
+
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+@api.route('/export')
+def export():
+    """ NDJSON export of the whole catalog, ?format=gzip compresses it. Clients can revalidate it per catalog generation """
+
+    status = CatalogStatus.get()
+    compressed = request.args.get('format', 'ndjson') == 'gzip'
+    etag = 'export-%d-%s' % (status.generation, 'gzip' if compressed else 'ndjson')
+
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    elif compressed:
+        response = Response(stream_with_context(gzip_stream(iter_export())), mimetype='application/gzip')
+        response.headers['Content-Disposition'] = 'attachment; filename=galaxycat-%d.ndjson.gz' % status.generation
+    else:
+        response = Response(stream_with_context(iter_export()), mimetype='application/x-ndjson')
+
+    response.set_etag(etag)
+    response.last_modified = status.update_date
+    response.cache_control.public = True
+    response.cache_control.no_cache = True
+    return response
@@ -1,16 +1,79 @@
 # coding=utf-8
 
+import hashlib
+
+from cStringIO import StringIO
+
 from flask import Flask
-from flask import render_template, request
+from flask import abort, make_response, render_template, request
 from flask_sqlalchemy import SQLAlchemy
+from functools import wraps
 from galaxycat import __version__
 from galaxycat.config import config
+from sqlalchemy import event
+from werkzeug.utils import import_string
 
 app = Flask(__name__)
 app.config.from_mapping(config)
 db = SQLAlchemy(app)
 
-from galaxycat.catalog import EDAMOperation, Instance, Tool  # NOQA
+if db.engine.dialect.name == 'sqlite':
+    # pysqlite commits before SAVEPOINT statements, SQLAlchemy begins the transactions
+    # itself so that update_catalog can roll back a single instance
+
+    @event.listens_for(db.engine, 'connect')
+    def sqlite_connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(db.engine, 'begin')
+    def sqlite_begin(connection):
+        connection.execute('BEGIN')
+
+from galaxycat.catalog import CatalogStatus, EDAMOperation, Instance, Tool  # NOQA
+from galaxycat.drift import get_version_drift, group_by_tool, write_csv  # NOQA
+
+page_cache = import_string(app.config['PAGE_CACHE_BACKEND'])(**app.config['PAGE_CACHE_OPTIONS'])
+
+if app.config['METRICS_ENABLED']:
+    from galaxycat.metrics import Metrics
+    metrics = Metrics(app, db.engine,
+                      slow_query_threshold=app.config['METRICS_SLOW_QUERY_THRESHOLD'],
+                      server_timing=app.config['METRICS_SERVER_TIMING'])
+
+
+def cached_page(view):
+    """
+    Cache the page rendered by ``view`` until the next harvest and answer
+    conditional requests with 304 using the catalog generation as ETag.
+    """
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        status = CatalogStatus.get()
+        key = repr((__version__, status.generation, request.endpoint, sorted(kwargs.items()), sorted(request.args.items(multi=True))))
+        etag = hashlib.sha1(key).hexdigest()
+
+        if request.if_none_match.contains(etag):
+            # the client already has this page, no need to render it
+            page, mimetype = '', None
+        else:
+            cached = page_cache.get(etag)
+            if cached is None:
+                response = make_response(view(*args, **kwargs))
+                cached = (response.get_data(), response.mimetype)
+                page_cache.set(etag, cached)
+            page, mimetype = cached
+
+        response = make_response(page)
+        if mimetype is not None:
+            response.mimetype = mimetype
+        response.set_etag(etag)
+        response.last_modified = status.update_date
+        response.cache_control.public = True
+        response.cache_control.no_cache = True  # caches must revalidate, which costs a 304 at most
+        return response.make_conditional(request)
+
+    return wrapper
 
 
 @app.context_processor
@@ -19,42 +82,81 @@ def utility_processor():
 
 
 @app.route("/")
+@cached_page
 def search():
 
     search = request.args.get('search', None)
-    tools = Tool.search(search)
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', app.config['SEARCH_PER_PAGE'], type=int), 1), app.config['SEARCH_MAX_PER_PAGE'])
 
-    return render_template('search.html', search=search, tools=tools)
+    tools_count = Tool.search_count(search)
+    tools = Tool.search(search, limit=per_page, offset=(page - 1) * per_page)
+    pages = (tools_count + per_page - 1) // per_page
 
+    return render_template('search.html', search=search, tools=tools, tools_count=tools_count, page=page, pages=pages, per_page=per_page)
 
-@app.route("/tools/<id>")
+
+@app.route("/tools/<int:id>")
+@cached_page
 def tool(id):
 
-    tool = Tool.query.get_or_404(id)
+    tool = Tool.get_document(id)
+    if tool is None:
+        abort(404)
 
     return render_template('tool.html', tool=tool)
 
 
 @app.route("/instances")
+@cached_page
 def instances():
 
-    instances = Instance.query.all()
+    instances = Instance.query.order_by(Instance.brand).all()
+    tools_counts = Instance.get_tools_counts()
 
-    return render_template('instances.html', instances=instances)
+    return render_template('instances.html', instances=instances, tools_counts=tools_counts)
 
 
 @app.route("/topics")
+@cached_page
 def topics():
 
-    topics = EDAMOperation.query.order_by(EDAMOperation.label).all()
-    max_tools_by_topic = max([len(topic.tools) for topic in topics])
-    for topic in topics:
-        topic.font_size = int((float(len(topic.tools)) / float(max_tools_by_topic)) * 20.0 + 10.0)
+    tools_counts = EDAMOperation.get_tools_counts()
+    max_tools_by_topic = max([topic.tools_count for topic in tools_counts] or [0])
+    topics = []
+    for topic in tools_counts:
+        topics.append({'label': topic.label,
+                       'font_size': int((float(topic.tools_count) / float(max(max_tools_by_topic, 1))) * 20.0 + 10.0)})
 
     return render_template('topics.html', topics=topics)
 
 
+@app.route("/drift")
+@cached_page
+def drift():
+
+    tools = group_by_tool(get_version_drift().rows)
+
+    return render_template('drift.html', tools=tools, instances_count=sum(len(tool[4]) for tool in tools))
+
+
+@app.route("/drift.csv")
+@cached_page
+def drift_csv():
+
+    output = StringIO()
+    write_csv(get_version_drift().rows, output)
+
+    response = make_response(output.getvalue())
+    response.mimetype = 'text/csv'
+    return response
+
+
 @app.route("/about")
 def about():
 
     return render_template('about.html', topics=topics)
+
+
+from galaxycat.api import api  # NOQA
+app.register_blueprint(api)
@@ -0,0 +1,151 @@
+# coding=utf-8
+
+""" In-memory index of which tools are available where, as bitsets of database ids """
+
+from binascii import hexlify, unhexlify
+
+
+def to_bitset(ids):
+    """ Returns the integer whose bit ``id`` is set for each id in ``ids`` """
+
+    ids = list(ids)
+    if not ids:
+        return 0
+    bitmap = bytearray((max(ids) >> 3) + 1)
+    for id in ids:
+        bitmap[id >> 3] |= 1 << (id & 7)
+    bitmap.reverse()
+    return int(hexlify(bitmap), 16)
+
+
+def iter_ids(bitset):
+    """ Yields the ids set in ``bitset`` in increasing order """
+
+    if not bitset:
+        return
+    digits = '%x' % bitset
+    bitmap = bytearray(unhexlify('0' * (len(digits) % 2) + digits))
+    bitmap.reverse()
+    for index, byte in enumerate(bitmap):
+        if byte:
+            for bit in xrange(8):
+                if byte >> bit & 1:
+                    yield (index << 3) + bit
+
+
+def count_ids(bitset):
+    return bin(bitset).count('1')
+
+
+def _bitsets(pairs):
+    """ Returns {key: bitset of values} from (key, value) pairs """
+
+    ids = {}
+    for key, value in pairs:
+        ids.setdefault(key, set()).add(value)
+    return dict((key, to_bitset(values)) for key, values in ids.iteritems())
+
+
+class AvailabilityIndex(object):
+    """
+    Tool availability of a catalog generation: a bitset of instance ids per tool and
+    per tool version, and a bitset of tool ids per instance and per EDAM operation.
+
+    Instance brands and operation labels are matched lower-cased, like the ``instance:``
+    and ``topic:`` search filters. The index is read-only once built, so it can be
+    shared by the threads of the webapp.
+    """
+
+    def __init__(self, generation, tool_instances, version_instances, instance_tools, operation_tools, brands, labels):
+        self.generation = generation
+        self.tool_instances = tool_instances
+        self.version_instances = version_instances
+        self.instance_tools = instance_tools
+        self.operation_tools = operation_tools
+        self.brands = brands  # lower-case brand: bitset of instance ids
+        self.labels = labels  # lower-case label: operation ids
+        self.available_tools = to_bitset(tool_instances)
+
+    @classmethod
+    def build(cls, links, operations, instances, generation=None):
+        """
+        ``links`` are (tool id, tool version id, instance id) rows, ``operations``
+        (tool id, operation id, label) rows and ``instances`` (instance id, brand) rows.
+        """
+
+        links = [link for link in links if link[0] is not None]
+        operations = list(operations)
+        labels = {}
+        for tool_id, operation_id, label in operations:
+            if label is not None:
+                labels.setdefault(label.lower(), set()).add(operation_id)
+
+        return cls(generation,
+                   tool_instances=_bitsets((tool_id, instance_id) for tool_id, tool_version_id, instance_id in links),
+                   version_instances=_bitsets((tool_version_id, instance_id) for tool_id, tool_version_id, instance_id in links),
+                   instance_tools=_bitsets((instance_id, tool_id) for tool_id, tool_version_id, instance_id in links),
+                   operation_tools=_bitsets((operation_id, tool_id) for tool_id, operation_id, label in operations),
+                   brands=_bitsets((brand.lower(), instance_id) for instance_id, brand in instances if brand is not None),
+                   labels=labels)
+
+    def is_available(self, tool_id, instance_id):
+        return bool(self.tool_instances.get(tool_id, 0) >> instance_id & 1)
+
+    def instances_of_tool(self, tool_id):
+        return list(iter_ids(self.tool_instances.get(tool_id, 0)))
+
+    def instances_of_version(self, tool_version_id):
+        return list(iter_ids(self.version_instances.get(tool_version_id, 0)))
+
+    def tools_of_instance(self, instance_id):
+        return list(iter_ids(self.instance_tools.get(instance_id, 0)))
+
+    def tools_counts(self, instance_id=None):
+        """ Number of distinct tools available on each instance, like Instance.get_tools_counts() """
+
+        if instance_id is not None:
+            tools = self.instance_tools.get(instance_id, 0)
+            return {instance_id: count_ids(tools)} if tools else {}
+        return dict((instance_id, count_ids(tools)) for instance_id, tools in self.instance_tools.iteritems())
+
+    def tools_on_all(self, instance_ids):
+        """ Bitset of the tools available on every instance of ``instance_ids`` """
+
+        tools = self.available_tools
+        for instance_id in instance_ids:
+            tools &= self.instance_tools.get(instance_id, 0)
+        return tools
+
+    def tools_on_any(self, instance_ids):
+        """ Bitset of the tools available on at least one instance of ``instance_ids`` """
+
+        tools = 0
+        for instance_id in instance_ids:
+            tools |= self.instance_tools.get(instance_id, 0)
+        return tools
+
+    def tools_with_brand(self, brand):
+        """ Bitset of the tools available on any instance branded ``brand`` """
+
+        return self.tools_on_any(iter_ids(self.brands.get(brand.lower(), 0)))
+
+    def tools_with_topic(self, label):
+        """ Bitset of the tools annotated with an EDAM operation labelled ``label`` """
+
+        tools = 0
+        for operation_id in self.labels.get(label.lower(), ()):
+            tools |= self.operation_tools.get(operation_id, 0)
+        return tools
+
+    def match(self, comparisons):
+        """ Bitset of the available tools matching every (key, value) ``topic:`` or ``instance:`` filter """
+
+        tools = self.available_tools
+        for key, value in comparisons:
+            if key == u"topic":
+                tools &= self.tools_with_topic(value)
+            elif key == u"instance":
+                tools &= self.tools_with_brand(value)
+            else:
+                raise KeyError(key)
+        return tools
@@ -2,26 +2,117 @@
 
 """ Uses Bioblend to connect to Galaxy instances and stores data about tools in a MongoDB database """
 
-import requests
-import urllib
-
-from bioblend import ConnectionError
-from bioblend.galaxy import GalaxyInstance
-from bioblend.galaxy.tools import ToolClient
-from datetime import datetime
-from galaxycat.app import db
-from pyparsing import Group, Literal, OneOrMore, QuotedString, Word
-from sqlalchemy import func
+import json
+import re
+import threading
+import time
+import traceback
+
+from collections import Counter
+from datetime import datetime, timedelta
+from galaxycat.app import app, db
+from galaxycat.availability import AvailabilityIndex, count_ids, iter_ids
+from galaxycat.cache import LRUCache
+from galaxycat.edam import EDAMResolver
+from galaxycat.fulltext import get_search_index
+from galaxycat.geoip import create_resolver, GeoCache
+from galaxycat.instrument import HarvestStats, InstanceStats
+from galaxycat.toolindex import index_tools, ToolIndex, VERSION_FIELDS, version_key, version_sort_key
+from sqlalchemy import bindparam, func, select
+from sqlalchemy.orm import subqueryload, undefer
 from urlparse import urlparse
 
+# galaxycat.harvest (bioblend), galaxycat.http (requests) and pyparsing are imported
+# on first use, so that the webapp and the CLI commands which do not harvest start faster
+
+http_session = None  # HarvestSession shared by the harvest, created on first use
+http_session_lock = threading.Lock()
+
+
+def get_http_session():
+
+    global http_session
+
+    if http_session is None:
+        with http_session_lock:
+            if http_session is None:
+                from galaxycat.http import HarvestSession
+                http_session = HarvestSession(timeout=app.config['HARVEST_TIMEOUT'],
+                                              connect_timeout=app.config['HTTP_CONNECT_TIMEOUT'],
+                                              retries=app.config['HTTP_RETRIES'],
+                                              backoff_factor=app.config['HTTP_BACKOFF_FACTOR'],
+                                              pool_size=app.config['HARVEST_WORKERS'])
+    return http_session
+
+
+edam_resolver = EDAMResolver(miss_ttl=app.config['EDAM_MISS_TTL'],
+                             workers=app.config['HARVEST_WORKERS'],
+                             timeout=app.config['HARVEST_TIMEOUT'],
+                             get_session=get_http_session)
+
+geo_cache = GeoCache(create_resolver(database=app.config['GEOIP_DATABASE'], timeout=app.config['GEOIP_TIMEOUT'], get_session=get_http_session),
+                     ttl=app.config['GEOIP_CACHE_TTL'],
+                     workers=app.config['HARVEST_WORKERS'],
+                     timeout=app.config['GEOIP_TIMEOUT'])
 
 toolversion_instance = db.Table('toolversion_instance',
                                 db.Column('tool_version_id', db.Integer, db.ForeignKey('tool_version.id')),
-                                db.Column('instance_id', db.Integer, db.ForeignKey('instance.id')))
+                                db.Column('instance_id', db.Integer, db.ForeignKey('instance.id'), index=True),
+                                db.PrimaryKeyConstraint('tool_version_id', 'instance_id', name='pk_toolversion_instance'))
 
 tool_edam_operation = db.Table('tool_edam_operation',
                                db.Column('tool_id', db.Integer, db.ForeignKey('tool.id')),
-                               db.Column('edam_operation_id', db.Unicode, db.ForeignKey('edam_operation.operation_id')))
+                               db.Column('edam_operation_id', db.Unicode, db.ForeignKey('edam_operation.operation_id'), index=True),
+                               db.PrimaryKeyConstraint('tool_id', 'edam_operation_id', name='pk_tool_edam_operation'))
+
+# EDAM operations of the tools as annotated by each instance, tool_edam_operation is their union
+tool_edam_operation_instance = db.Table('tool_edam_operation_instance',
+                                        db.Column('tool_id', db.Integer, db.ForeignKey('tool.id')),
+                                        db.Column('edam_operation_id', db.Unicode, db.ForeignKey('edam_operation.operation_id')),
+                                        db.Column('instance_id', db.Integer, db.ForeignKey('instance.id'), index=True),
+                                        db.PrimaryKeyConstraint('tool_id', 'edam_operation_id', 'instance_id',
+                                                                name='pk_tool_edam_operation_instance'))
+
+# JSON detail document of each tool, see Tool.build_documents()
+tool_document = db.Table('tool_document',
+                         db.Column('tool_id', db.Integer, db.ForeignKey('tool.id'), primary_key=True),
+                         db.Column('document', db.Text, nullable=False))
+
+
+class CatalogStatus(db.Model):
+    """ Single row table whose generation is bumped by every harvest, cached pages are keyed by generation """
+
+    __tablename__ = 'catalog_status'
+
+    id = db.Column(db.Integer, primary_key=True)
+    generation = db.Column(db.Integer, nullable=False, default=0)
+    update_date = db.Column(db.DateTime())  # UTC, as it is sent in the Last-Modified header of the pages
+
+    @classmethod
+    def get(cls):
+
+        status = CatalogStatus.query.get(1)
+        if status is None:
+            status = CatalogStatus(id=1, generation=0)
+        return status
+
+    @classmethod
+    def bump(cls):
+        """
+        Must be called in the transaction of the harvest so that the new generation appears with the new catalog.
+        The detail documents of the tools modified by the harvest are rebuilt first.
+        """
+
+        Tool.refresh_documents()
+        status = CatalogStatus.query.with_for_update().get(1)
+        if status is None:
+            status = CatalogStatus(id=1, generation=0)
+            db.session.add(status)
+        status.generation += 1
+        status.update_date = datetime.utcnow()
+        db.session.flush()
+
+        return status
 
 
 class Instance(db.Model):
@@ -44,6 +135,18 @@ class Instance(db.Model):
     country_code = db.Column(db.Unicode())
     latitude = db.Column(db.Float())
     longitude = db.Column(db.Float())
+    location_date = db.Column(db.DateTime())
+    tools_fingerprint = db.Column(db.Unicode())
+    tools_etag = db.Column(db.Unicode())
+    tools_last_modified = db.Column(db.Unicode())
+    last_success_date = db.Column(db.DateTime())
+    last_duration = db.Column(db.Float())
+    # schedule of harvestd, see galaxycat.scheduler
+    next_harvest_date = db.Column(db.DateTime(), index=True)
+    harvest_interval = db.Column(db.Float())
+    harvest_failures = db.Column(db.Integer, nullable=False, default=0)
+    harvest_lock_owner = db.Column(db.Unicode())
+    harvest_lock_date = db.Column(db.DateTime())
 
     # {
     #     "as":"AS2259 UNIVERSITE DE STRASBOURG",
@@ -64,50 +167,129 @@ class Instance(db.Model):
 
     @classmethod
     def add_instance(cls, url):
+        """ Add or refresh a single instance, returns False when the instance is being harvested by harvestd or another command """
 
+        from galaxycat.harvest import fetch_instance
+        from galaxycat.scheduler import acquire_lock, lock_owner, release_locks
+
+        owner = lock_owner()
         instance = Instance.query.filter_by(url=url).first()
+        previous = None
+        if instance is not None:
+            if not acquire_lock(instance.id, owner, app.config['HARVESTD_LOCK_TTL']):
+                print "%s is being harvested by %s" % (url, instance.harvest_lock_owner)
+                return False
+            previous = instance.get_validators()
+            instance.cache_location()
+        try:
+            instance_data = fetch_instance(url, timeout=app.config['HARVEST_TIMEOUT'], previous=previous, geo_cache=geo_cache,
+                                           session=get_http_session())
+            Instance.store_instance(instance_data)
+        finally:
+            db.session.rollback()
+            release_locks(owner)
+        return True
+
+    def get_validators(self):
+        """ What the last harvest knows about the tool list of the instance, see harvest.fetch_instance """
+
+        return {'version': self.version, 'etag': self.tools_etag, 'last_modified': self.tools_last_modified}
+
+    def cache_location(self):
+        """ Put the stored location in geo_cache so that it is not looked up again before GEOIP_CACHE_TTL """
+
+        if self.location_date is not None:
+            geo_cache.add(urlparse(self.url).hostname,
+                          {'city': self.city, 'zip': self.zipcode, 'country': self.country,
+                           'countryCode': self.country_code, 'lat': self.latitude, 'lon': self.longitude},
+                          timestamp=time.mktime(self.location_date.timetuple()))
+
+    @classmethod
+    def store_instance(cls, instance_data, commit=True, stats=None):
+        """
+        Store the data fetched from an instance, the tools are skipped when the
+        tool list fingerprint has not changed. Returns True when the catalog changed.
+        ``stats`` is the InstanceStats of the instance when the harvest is instrumented.
+        """
+
+        start = time.time()
+        if instance_data.error is not None:
+            print "Unable to add or update %s" % instance_data.url
+            return False
+
+        instance = Instance.query.filter_by(url=instance_data.url).first()
         if instance is None:
-            instance = Instance(url=url)
+            instance = Instance(url=instance_data.url)
             db.session.add(instance)
 
-        try:
-            galaxy_instance = GalaxyInstance(url=url)
-            instance_config = galaxy_instance.config.get_config()
-
-            instance.update_date = datetime.now()
-            instance.allow_user_creation = instance_config['allow_user_creation']
-            instance.brand = instance_config['brand']
-            instance.enable_quotas = 'enable_quotas' in instance_config and instance_config['enable_quotas']
-            instance.require_login = 'require_login' in instance_config and instance_config['require_login']
-            instance.terms_url = instance_config['terms_url']
-            instance.version = instance_config['version_major']
-
-            url_data = urlparse(url)
-            try:
-                instance_location = requests.get('http://ip-api.com/json/%s' % url_data.netloc)
-            except requests.exceptions.ConnectionError, requests.exceptions.ReadTimeout:
-                print "Unable to get location data for %s" % url_data.netloc
-            else:
-                try:
-                    instance_location = instance_location.json()
-                except ValueError:
-                    print "Unable to decode location data for %s" % url_data.netloc
-                else:
-                    instance.city = instance_location.get('city', None)
-                    instance.zipcode = instance_location.get('zip', None)
-                    instance.country = instance_location.get('country', None)
-                    instance.country_code = instance_location.get('countryCode', None)
-                    instance.latitude = instance_location.get('lat', None)
-                    instance.longitude = instance_location.get('lon', None)
-
+        for key, value in instance_data.config.iteritems():
+            setattr(instance, key, value)
+
+        instance_location = instance_data.location
+        if instance_location is not None:
+            instance.city = instance_location.get('city', None)
+            instance.zipcode = instance_location.get('zip', None)
+            instance.country = instance_location.get('country', None)
+            instance.country_code = instance_location.get('countryCode', None)
+            instance.latitude = instance_location.get('lat', None)
+            instance.longitude = instance_location.get('lon', None)
+            # geo_cache serves the stored location until it expires, then looks it up again
+            if instance.location_date is None or instance.location_date < datetime.now() - timedelta(seconds=geo_cache.ttl):
+                instance.location_date = datetime.now()
+
+        changed = instance in db.session.new or db.session.is_modified(instance)
+        db.session.flush()
+
+        complete = True
+        if instance_data.not_modified or instance_data.fingerprint == instance.tools_fingerprint:
+            print "%s: tools unchanged since the last harvest" % instance.url
+        else:
+            report = Tool.retrieve_tools_from_instance(instance=instance, tools=instance_data.tools, commit=False, stats=stats)
+            total = sum(report.values(), Counter())
+            print "%s: %d rows inserted, %d updated, %d deleted, %d unchanged" % (instance.url, total['inserted'], total['updated'], total['deleted'], total['unchanged'])
+
+            # operations OLS failed to answer for are not linked, the next harvest reads the tool list again to link them
+            complete = not edam_resolver.unresolved(set(operation_id for tool_data in instance_data.tools.tools.itervalues()
+                                                        for operation_id in tool_data['edam_operations']))
+            if not complete:
+                print "%s: some EDAM operations could not be resolved, the tools will be read again by the next harvest" % instance.url
+
+            instance.tools_fingerprint = instance_data.fingerprint if complete else None
+            # a tool list read again only for its unresolved operations may not change anything
+            if total['inserted'] or total['updated'] or total['deleted']:
+                instance.update_date = datetime.now()
+                changed = True
+
+        instance.tools_etag = instance_data.etag if complete else None
+        instance.tools_last_modified = instance_data.last_modified if complete else None
+        instance.last_success_date = datetime.now()
+        instance.last_duration = instance_data.duration + time.time() - start
+
+        if commit:
+            if changed:
+                CatalogStatus.bump()
             db.session.commit()
 
-            Tool.retrieve_tools_from_instance(instance=instance)
-        except ConnectionError:
-            print "Unable to add or update %s" % url
+        return changed
 
     def get_tools_count(self):
-        return len(Tool.query.outerjoin(EDAMOperation, Tool.edam_operations).join(ToolVersion).join(Instance, ToolVersion.instances).filter(Instance.id == self.id).all())
+        return Instance.get_tools_counts(instance_id=self.id).get(self.id, 0)
+
+    @classmethod
+    def get_tools_counts(cls, instance_id=None):
+        """ Returns the number of distinct tools available on each instance, by instance id, with a single grouped query """
+
+        availability_index = get_availability_index()
+        if availability_index is not None:
+            return availability_index.tools_counts(instance_id)
+
+        query = select([toolversion_instance.c.instance_id, func.count(ToolVersion.tool_id.distinct())])\
+            .select_from(toolversion_instance.join(ToolVersion.__table__))\
+            .group_by(toolversion_instance.c.instance_id)
+        if instance_id is not None:
+            query = query.where(toolversion_instance.c.instance_id == instance_id)
+
+        return dict(db.session.execute(query).fetchall())
 
     @property
     def location(self):
@@ -117,6 +299,10 @@ class Instance(db.Model):
             return "Unknown"
 
 
+# instance: searches compare lower-case brands
+db.Index('ix_instance_lower_brand', func.lower(Instance.brand))
+
+
 class EDAMOperation(db.Model):
 
     __tablename__ = 'edam_operation'
@@ -129,25 +315,63 @@ class EDAMOperation(db.Model):
     @classmethod
     def get_from_id(cls, operation_id, allow_creation=False):
 
-        edam_operation = EDAMOperation.query.filter_by(operation_id=operation_id).first()
-        if edam_operation is None and allow_creation:
-            iri = 'http://edamontology.org/%s' % operation_id
-            api_url = 'http://www.ebi.ac.uk/ols/api/ontologies/edam/terms/%s' % urllib.quote(urllib.quote(iri, safe=''), safe='')
-            edam_response = requests.get(api_url)
-            if edam_response.status_code == 200:
-                edam_data = edam_response.json()
-                edam_operation = EDAMOperation(operation_id=operation_id,
-                                               iri=iri,
-                                               label=edam_data['label'],
-                                               description=" ".join(edam_data['description']))
+        return EDAMOperation.get_from_ids([operation_id], allow_creation=allow_creation).get(operation_id, None)
+
+    @classmethod
+    def get_from_ids(cls, operation_ids, allow_creation=False):
+        """ Returns a dict of EDAMOperation by id, ids missing from the catalog are resolved at once through the EDAM resolver """
+
+        operation_ids = set(operation_ids)
+        edam_operations = {}
+        for ids in _chunks(operation_ids):
+            for edam_operation in EDAMOperation.query.filter(EDAMOperation.operation_id.in_(ids)):
+                edam_operations[edam_operation.operation_id] = edam_operation
+
+        for edam_operation in edam_operations.itervalues():
+            edam_resolver.add({'operation_id': edam_operation.operation_id,
+                               'iri': edam_operation.iri,
+                               'label': edam_operation.label,
+                               'description': edam_operation.description})
+
+        missing_ids = operation_ids - set(edam_operations)
+        if missing_ids and allow_creation:
+            for operation_id, term in edam_resolver.resolve(missing_ids).iteritems():
+                edam_operation = EDAMOperation(**term)
                 db.session.add(edam_operation)
+                edam_operations[operation_id] = edam_operation
+
+        return edam_operations
+
+    @classmethod
+    def get_tools_counts(cls):
+        """ Returns (operation_id, label, tools_count) rows for every EDAM operation ordered by label then id, with a single grouped query """
+
+        query = select([EDAMOperation.operation_id, EDAMOperation.label, func.count(tool_edam_operation.c.tool_id).label('tools_count')])\
+            .select_from(EDAMOperation.__table__.outerjoin(tool_edam_operation))\
+            .group_by(EDAMOperation.operation_id, EDAMOperation.label)\
+            .order_by(EDAMOperation.label, EDAMOperation.operation_id)
+
+        return db.session.execute(query).fetchall()
+
+    @classmethod
+    def prefetch(cls, dump=None):
+        """ Fill the EDAM resolver before harvesting, from an EDAM.tsv/EDAM.owl ``dump`` or from OLS """
+
+        if dump is not None:
+            edam_resolver.load_dump(dump)
+        else:
+            edam_resolver.load_ols()
+
 
-        return edam_operation
+# topic: searches compare lower-case labels
+db.Index('ix_edam_operation_lower_label', func.lower(EDAMOperation.label))
 
 
 class ToolVersion(db.Model):
 
     __tablename__ = 'tool_version'
+    __table_args__ = (db.Index('ix_tool_version_tool_shed_key', 'name', 'changeset', 'tool_shed', 'owner'),
+                      db.Index('ix_tool_version_local_key', 'name', 'version'))
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.Unicode(), nullable=False)
@@ -155,9 +379,14 @@ class ToolVersion(db.Model):
     tool_shed = db.Column(db.Unicode())
     owner = db.Column(db.Unicode())
     changeset = db.Column(db.Unicode())
-    tool_id = db.Column(db.Integer, db.ForeignKey('tool.id'))
+    # orders the versions of a tool like version numbers, see galaxycat.toolindex.version_sort_key()
+    sort_key = db.Column(db.Unicode(), default=lambda context: version_sort_key(context.current_parameters['version']))
+    tool_id = db.Column(db.Integer, db.ForeignKey('tool.id'), index=True)
     instances = db.relationship('Instance', secondary=toolversion_instance, backref=db.backref('tool_versions'))
 
+    # key identifying a tool version across instances, from a row or a dict
+    natural_key = staticmethod(version_key)
+
 
 class Tool(db.Model):
 
@@ -169,110 +398,563 @@ class Tool(db.Model):
     display_name = db.Column(db.Unicode())
     link = db.Column(db.Unicode())
     versions = db.relationship('ToolVersion', backref='tool')
-    edam_operations = db.relationship('EDAMOperation', secondary=tool_edam_operation, backref=db.backref('tools'))
+    edam_operations = db.relationship('EDAMOperation', secondary=tool_edam_operation, backref=db.backref('tools'), order_by='EDAMOperation.label')
+    versions_count = db.column_property(select([func.count(ToolVersion.id)]).where(ToolVersion.tool_id == id).correlate_except(ToolVersion),
+                                        deferred=True)
 
     @classmethod
-    def retrieve_tools_from_instance(cls, instance):
-
-        galaxy_instance = GalaxyInstance(url=instance.url)
-        tool_client = ToolClient(galaxy_instance)
-        for element in tool_client.get_tools():
-            if element['model_class'] == 'Tool':
-
-                tool_name = element['id']
-                if '/' in tool_name:
-                    tool_name = tool_name.split('/')[-2]
-
-                tool = Tool.query.filter_by(name=tool_name).first()
-                if tool is None:
-                    tool = Tool(name=tool_name)
-                    db.session.add(tool)
-
-                tool.description = element['description']
-                tool.display_name = element['name']
-                if 'link' in element:
-                    link = element.get('link', None)
-                    link_start = link.find('/tool_runner')
-                    if link_start != -1:
-                        tool.link = link[link_start:]
-
-                for edam_opetation_id in element.get('edam_operations', []):
-                    edam_operation = EDAMOperation.get_from_id(edam_opetation_id, allow_creation=True)
-                    if edam_operation is not None and edam_operation not in tool.edam_operations:
-                        tool.edam_operations.append(edam_operation)
-
-                if 'tool_shed_repository' in element:
-                    tool_version = ToolVersion.query\
-                                              .filter_by(name=tool_name)\
-                                              .filter_by(changeset=element['tool_shed_repository']['changeset_revision'])\
-                                              .filter_by(tool_shed=element['tool_shed_repository']['tool_shed'])\
-                                              .filter_by(owner=element['tool_shed_repository']['owner'])\
-                                              .first()
+    def retrieve_tools_from_instance(cls, instance, tools=None, commit=True, stats=None, chunk_size=None):
+        """
+        Store the tools of ``instance`` and link their versions to it, returns a Counter of inserted,
+        updated, unchanged and deleted rows per table.
+
+        ``tools`` is a ToolIndex, a tool list as returned by ToolClient.get_tools(), or None
+        to download it. Tools are written ``chunk_size`` at a time so that the rows loaded
+        from the database stay bounded whatever the size of the instance.
+        """
+
+        if stats is None:
+            stats = InstanceStats(instance.url)
+        if chunk_size is None:
+            chunk_size = app.config['HARVEST_CHUNK_SIZE']
+        if tools is None:
+            from galaxycat.harvest import fetch_tools, HarvestGalaxyInstance
+            galaxy_instance = HarvestGalaxyInstance(url=instance.url, timeout=app.config['HARVEST_TIMEOUT'], session=get_http_session())
+            tools = fetch_tools(galaxy_instance, instance.version, deadline=time.time() + app.config['HARVEST_TIMEOUT'])[0]
+        elif not isinstance(tools, ToolIndex):
+            tools = index_tools(tools, instance.version)
+
+        report = dict((table, Counter()) for table in ('tool', 'tool_version', 'tool_edam_operation', 'tool_edam_operation_instance',
+                                                      'toolversion_instance'))
+        tool_table = Tool.__table__
+        tool_version_table = ToolVersion.__table__
+        annotation_table = tool_edam_operation_instance
+        search_index = get_search_index(db, app.config['SEARCH_BACKEND'])
+
+        versions_by_tool = {}
+        for natural_key, version_fields in tools.versions.iteritems():
+            versions_by_tool.setdefault(version_fields[0], []).append(natural_key)
+
+        edam_operation_ids = set()
+        for tool_data in tools.tools.itervalues():
+            edam_operation_ids.update(tool_data['edam_operations'])
+        with stats.stage('edam'):
+            edam_operations = EDAMOperation.get_from_ids(edam_operation_ids, allow_creation=True)
+            db.session.flush()
+
+        def load_versions(names):
+            versions = {}
+            for chunk in _chunks(names):
+                query = select([tool_version_table]).where(tool_version_table.c.name.in_(chunk))
+                for row in db.session.execute(query.order_by(tool_version_table.c.id)):
+                    versions.setdefault(ToolVersion.natural_key(row), row)
+            return versions
+
+        query = select([toolversion_instance.c.tool_version_id]).where(toolversion_instance.c.instance_id == instance.id)
+        existing_instance_links = set(row.tool_version_id for row in db.session.execute(query))
+        current_version_ids = set()
+        current_tool_ids = set()
+        annotated_tools = set()  # ids of the tools whose EDAM operations on this instance changed
+        modified_tools = set()  # ids of the tools whose detail document is outdated
+
+        for names in _chunks(sorted(tools.tools), chunk_size):
+            tools_data = dict((tool_name, tools.tools[tool_name]) for tool_name in names)
+            versions_data = dict((natural_key, dict(zip(VERSION_FIELDS, tools.versions[natural_key])))
+                                 for tool_name in names for natural_key in versions_by_tool[tool_name])
+
+            # tools
+            existing_tools = {}
+            for chunk in _chunks(names):
+                query = select([tool_table.c.id, tool_table.c.name, tool_table.c.description, tool_table.c.display_name, tool_table.c.link])
+                for row in db.session.execute(query.where(tool_table.c.name.in_(chunk))):
+                    existing_tools[row.name] = row
+
+            new_tools = []
+            updated_tools = []
+            for tool_name, tool_data in tools_data.iteritems():
+                row = existing_tools.get(tool_name, None)
+                if row is None:
+                    new_tools.append({'name': tool_name,
+                                      'description': tool_data['description'],
+                                      'display_name': tool_data['display_name'],
+                                      'link': tool_data['link']})
+                    continue
+
+                if tool_data['link'] is None:
+                    tool_data['link'] = row.link
+                if (row.description, row.display_name, row.link) == (tool_data['description'], tool_data['display_name'], tool_data['link']):
+                    report['tool']['unchanged'] += 1
+                else:
+                    updated_tools.append({'_id': row.id,
+                                          'description': tool_data['description'],
+                                          'display_name': tool_data['display_name'],
+                                          'link': tool_data['link']})
+
+            if new_tools:
+                db.session.execute(tool_table.insert(), new_tools)
+                report['tool']['inserted'] += len(new_tools)
+            if updated_tools:
+                db.session.execute(tool_table.update()
+                                             .where(tool_table.c.id == bindparam('_id'))
+                                             .values(description=bindparam('description'),
+                                                     display_name=bindparam('display_name'),
+                                                     link=bindparam('link')),
+                                   updated_tools)
+                report['tool']['updated'] += len(updated_tools)
+                modified_tools.update(tool['_id'] for tool in updated_tools)
+
+            tool_ids = dict((tool_name, row.id) for tool_name, row in existing_tools.iteritems())
+            for chunk in _chunks([tool['name'] for tool in new_tools]):
+                query = select([tool_table.c.id, tool_table.c.name]).where(tool_table.c.name.in_(chunk))
+                tool_ids.update((row.name, row.id) for row in db.session.execute(query))
+
+            if search_index is not None:
+                search_index.update([tool_ids[tool['name']] for tool in new_tools] + [tool['_id'] for tool in updated_tools])
+
+            current_tool_ids.update(tool_ids.itervalues())
+
+            # tool <-> EDAM operation links of this instance, merged into tool_edam_operation once every chunk is stored
+            existing_annotations = set()
+            for ids in _chunks(tool_ids.values()):
+                query = select([annotation_table.c.tool_id, annotation_table.c.edam_operation_id])\
+                    .where(annotation_table.c.instance_id == instance.id)\
+                    .where(annotation_table.c.tool_id.in_(ids))
+                existing_annotations.update((row.tool_id, row.edam_operation_id) for row in db.session.execute(query))
+
+            current_annotations = set((tool_ids[tool_name], edam_operation_id)
+                                      for tool_name, tool_data in tools_data.iteritems()
+                                      for edam_operation_id in tool_data['edam_operations'] if edam_operation_id in edam_operations)
+            new_annotations = current_annotations - existing_annotations
+            stale_annotations = existing_annotations - current_annotations
+            if new_annotations:
+                db.session.execute(annotation_table.insert(), [{'tool_id': tool_id, 'edam_operation_id': edam_operation_id, 'instance_id': instance.id}
+                                                               for tool_id, edam_operation_id in new_annotations])
+            if stale_annotations:
+                db.session.execute(annotation_table.delete()
+                                                   .where(annotation_table.c.instance_id == instance.id)
+                                                   .where(annotation_table.c.tool_id == bindparam('_tool_id'))
+                                                   .where(annotation_table.c.edam_operation_id == bindparam('_edam_operation_id')),
+                                   [{'_tool_id': tool_id, '_edam_operation_id': edam_operation_id} for tool_id, edam_operation_id in stale_annotations])
+            report['tool_edam_operation_instance']['inserted'] += len(new_annotations)
+            report['tool_edam_operation_instance']['deleted'] += len(stale_annotations)
+            report['tool_edam_operation_instance']['unchanged'] += len(current_annotations & existing_annotations)
+            annotated_tools.update(tool_id for tool_id, edam_operation_id in new_annotations | stale_annotations)
+
+            # tool versions
+            existing_versions = load_versions(names)
+            new_versions = []
+            updated_versions = []
+            for natural_key, version_data in versions_data.iteritems():
+                row = existing_versions.get(natural_key, None)
+                if row is None:
+                    version_data['tool_id'] = tool_ids[version_data['name']]
+                    new_versions.append(version_data)
+                elif row.tool_id != tool_ids[version_data['name']]:
+                    updated_versions.append({'_id': row.id, 'tool_id': tool_ids[version_data['name']]})
+                    modified_tools.update([row.tool_id, tool_ids[version_data['name']]])
                 else:
-                    tool_version = ToolVersion.query\
-                                              .filter_by(name=tool_name)\
-                                              .filter_by(version=element['version'])\
-                                              .filter_by(tool_shed=None)\
-                                              .filter_by(owner=None)\
-                                              .first()
-                if tool_version is None:
-                    tool_version = ToolVersion(name=tool_name,
-                                               version=element['version'])
-                    db.session.add(tool_version)
-
-                if 'tool_shed_repository' in element:
-                    tool_version.changeset = element['tool_shed_repository']['changeset_revision']
-                    tool_version.tool_shed = element['tool_shed_repository']['tool_shed']
-                    tool_version.owner = element['tool_shed_repository']['owner']
-
-                if instance not in tool_version.instances:
-                    tool_version.instances.append(instance)
-
-                if tool_version not in tool.versions:
-                    tool.versions.append(tool_version)
-
-                db.session.commit()
+                    report['tool_version']['unchanged'] += 1
+
+            if new_versions:
+                db.session.execute(tool_version_table.insert(), new_versions)
+                report['tool_version']['inserted'] += len(new_versions)
+                existing_versions.update(load_versions(set(version['name'] for version in new_versions)))
+            if updated_versions:
+                db.session.execute(tool_version_table.update()
+                                                     .where(tool_version_table.c.id == bindparam('_id'))
+                                                     .values(tool_id=bindparam('tool_id')),
+                                   updated_versions)
+                report['tool_version']['updated'] += len(updated_versions)
+
+            # tool version <-> instance links
+            new_instance_links = []
+            for natural_key in versions_data:
+                tool_version_id = existing_versions[natural_key].id
+                current_version_ids.add(tool_version_id)
+                if tool_version_id in existing_instance_links:
+                    report['toolversion_instance']['unchanged'] += 1
+                else:
+                    new_instance_links.append({'tool_version_id': tool_version_id, 'instance_id': instance.id})
+                    modified_tools.add(tool_ids[versions_data[natural_key]['name']])
+            if new_instance_links:
+                db.session.execute(toolversion_instance.insert(), new_instance_links)
+                report['toolversion_instance']['inserted'] += len(new_instance_links)
+
+        # versions uninstalled from the instance since the last harvest
+        stale_instance_links = existing_instance_links - current_version_ids
+        for ids in _chunks(stale_instance_links):
+            query = select([tool_version_table.c.tool_id]).where(tool_version_table.c.id.in_(ids))
+            modified_tools.update(row.tool_id for row in db.session.execute(query))
+            db.session.execute(toolversion_instance.delete()
+                                                   .where(toolversion_instance.c.instance_id == instance.id)
+                                                   .where(toolversion_instance.c.tool_version_id.in_(ids)))
+        report['toolversion_instance']['deleted'] += len(stale_instance_links)
+
+        # annotations of the tools removed from the instance since the last harvest
+        query = select([annotation_table.c.tool_id]).where(annotation_table.c.instance_id == instance.id).distinct()
+        removed_tools = set(row.tool_id for row in db.session.execute(query)) - current_tool_ids
+        for ids in _chunks(removed_tools):
+            report['tool_edam_operation_instance']['deleted'] += db.session.execute(annotation_table.delete()
+                                                                                                    .where(annotation_table.c.instance_id == instance.id)
+                                                                                                    .where(annotation_table.c.tool_id.in_(ids))).rowcount
+        annotated_tools.update(removed_tools)
+
+        edam_report, edam_tools = Tool.merge_edam_operations(annotated_tools)
+        report['tool_edam_operation'].update(edam_report)
+        modified_tools.update(edam_tools)
+
+        Tool.invalidate_documents(modified_tools)
+
+        if commit:
+            CatalogStatus.bump()
+            db.session.commit()
+
+        return report
 
     @classmethod
-    def search(cls, search):
-        if search is None or len(search) == 0:
-            return []
+    def merge_edam_operations(cls, tool_ids):
+        """
+        Set the EDAM operations of ``tool_ids`` to the union of their operations on every instance
+        providing them, so an operation no instance annotates a tool with any more is unlinked.
+        Returns (Counter of inserted, deleted and unchanged links, ids of the tools whose links changed).
+        """
+
+        report = Counter()
+        modified_tools = set()
+        for ids in _chunks(tool_ids):
+            query = select([tool_edam_operation_instance.c.tool_id, tool_edam_operation_instance.c.edam_operation_id])\
+                .where(tool_edam_operation_instance.c.tool_id.in_(ids))\
+                .distinct()
+            annotations = set((row.tool_id, row.edam_operation_id) for row in db.session.execute(query))
+            query = select([tool_edam_operation.c.tool_id, tool_edam_operation.c.edam_operation_id]).where(tool_edam_operation.c.tool_id.in_(ids))
+            links = set((row.tool_id, row.edam_operation_id) for row in db.session.execute(query))
+
+            new_links = annotations - links
+            stale_links = links - annotations
+            if new_links:
+                db.session.execute(tool_edam_operation.insert(), [{'tool_id': tool_id, 'edam_operation_id': edam_operation_id}
+                                                                  for tool_id, edam_operation_id in new_links])
+            if stale_links:
+                db.session.execute(tool_edam_operation.delete()
+                                                      .where(tool_edam_operation.c.tool_id == bindparam('_tool_id'))
+                                                      .where(tool_edam_operation.c.edam_operation_id == bindparam('_edam_operation_id')),
+                                   [{'_tool_id': tool_id, '_edam_operation_id': edam_operation_id} for tool_id, edam_operation_id in stale_links])
+            report['inserted'] += len(new_links)
+            report['deleted'] += len(stale_links)
+            report['unchanged'] += len(links & annotations)
+            modified_tools.update(tool_id for tool_id, edam_operation_id in new_links | stale_links)
+
+        return report, modified_tools
 
-        query = Tool.query.outerjoin(EDAMOperation, Tool.edam_operations).join(ToolVersion).join(Instance, ToolVersion.instances)
-        nodes = parse_search_query(search)
-        for node in nodes:
-            if type(node) == ComparisonNode:
-                key = node[0]
-                value = u" ".join(node[2]).lower()
+    @classmethod
+    def search_query(cls, search):
+        """ Returns the query of the tools matching ``search`` by relevance, or None when ``search`` cannot match any tool """
+
+        if search is None or len(search) == 0:
+            return None
+
+        parsed = split_search_query(search)
+        if parsed is None:
+            # unknown key
+            return None
+        terms, comparisons = parsed
+
+        query = Tool.query
+        availability_index = get_availability_index()
+        matching_tools = availability_index.match(comparisons) if availability_index is not None else None
+        if matching_tools == 0:
+            return None
+
+        if comparisons and matching_tools is not None and count_ids(matching_tools) <= app.config['AVAILABILITY_INDEX_MAX_IDS']:
+            # filters resolved in memory, only the ids of the matching tools reach the database
+            query = query.filter(Tool.id.in_(list(iter_ids(matching_tools))))
+        else:
+            # filters are IN subqueries rather than joins so that each tool is returned once
+            available_tools = select([ToolVersion.tool_id]).select_from(ToolVersion.__table__.join(toolversion_instance))
+            query = query.filter(Tool.id.in_(available_tools))
+            for key, value in comparisons:
                 if key == u"topic":
-                    query = query.filter(func.lower(EDAMOperation.label) == value)
-                elif key == u"instance":
-                    query = query.filter(func.lower(Instance.brand) == value)
+                    topic_tools = select([tool_edam_operation.c.tool_id])\
+                        .select_from(tool_edam_operation.join(EDAMOperation.__table__))\
+                        .where(func.lower(EDAMOperation.label) == value)
+                    query = query.filter(Tool.id.in_(topic_tools))
                 else:
-                    # unknown key
-                    return []
-            else:
-                term = "%{0}%".format(" ".join(node).lower())
+                    instance_tools = select([ToolVersion.tool_id])\
+                        .select_from(ToolVersion.__table__.join(toolversion_instance).join(Instance.__table__))\
+                        .where(func.lower(Instance.brand) == value)
+                    query = query.filter(Tool.id.in_(instance_tools))
+
+        # terms match substrings of the name, display name or description, through the index when it can look them up
+        search_index = get_search_index(db, app.config['SEARCH_BACKEND'])
+        indexed_terms = [term for term in terms if search_index is not None and search_index.can_match(term)]
+        if indexed_terms:
+            ranked = search_index.match(indexed_terms)
+            query = query.join(ranked, ranked.c.tool_id == Tool.id).order_by(ranked.c.score.desc())
+        for term in terms:
+            if term not in indexed_terms:
+                term = u"%{0}%".format(term)
                 query = query.filter(Tool.name.ilike(term) | Tool.description.ilike(term) | Tool.display_name.ilike(term))
 
-        return query.all()
+        return query.order_by(Tool.display_name, Tool.id)
+
+    @classmethod
+    def search(cls, search, limit=None, offset=None):
+        """ Returns a page of the tools matching ``search`` with their topics and version counts loaded in one extra query """
+
+        query = Tool.search_query(search)
+        if query is None:
+            return []
+
+        query = query.options(subqueryload(Tool.edam_operations), undefer(Tool.versions_count))
+        return query.limit(limit).offset(offset).all()
+
+    @classmethod
+    def search_count(cls, search):
+
+        availability_index = get_availability_index()
+        if availability_index is not None and search:
+            parsed = split_search_query(search)
+            if parsed is not None and not parsed[0]:
+                # filters only, counted in memory
+                return count_ids(availability_index.match(parsed[1]))
+
+        query = Tool.search_query(search)
+        if query is None:
+            return 0
+
+        return query.order_by(None).with_entities(func.count(Tool.id)).scalar()
+
+    @classmethod
+    def delete_orphans(cls):
+        """ Delete the tool versions no longer available on any instance, then the tools left without version """
+
+        tool_version_table = ToolVersion.__table__
+        linked_versions = select([toolversion_instance.c.tool_version_id])
+        versioned_tools = select([tool_version_table.c.tool_id]).where(tool_version_table.c.tool_id != None)  # NOQA
+
+        # the documents of the tools losing versions are rebuilt, those of the deleted tools are not
+        db.session.execute(tool_document.delete()
+                                        .where(tool_document.c.tool_id.in_(select([tool_version_table.c.tool_id])
+                                                                           .where(~tool_version_table.c.id.in_(linked_versions))) |
+                                               ~tool_document.c.tool_id.in_(versioned_tools)))
+
+        report = Counter()
+        report['tool_version'] = db.session.execute(tool_version_table.delete()
+                                                                      .where(~tool_version_table.c.id.in_(linked_versions))).rowcount
+        report['tool_edam_operation'] = db.session.execute(tool_edam_operation.delete()
+                                                                              .where(~tool_edam_operation.c.tool_id.in_(versioned_tools))).rowcount
+        report['tool_edam_operation_instance'] = db.session.execute(tool_edam_operation_instance.delete()
+                                                                                                .where(~tool_edam_operation_instance.c.tool_id.in_(versioned_tools))).rowcount
+        report['tool'] = db.session.execute(Tool.__table__.delete()
+                                                          .where(~Tool.__table__.c.id.in_(versioned_tools))).rowcount
+
+        search_index = get_search_index(db, app.config['SEARCH_BACKEND'])
+        if search_index is not None:
+            search_index.delete_orphans()
+
+        return report
 
     @classmethod
-    def update_catalog(cls):
+    def build_documents(cls, tool_ids):
+        """
+        Returns {tool id: detail document} for ``tool_ids``, with four queries whatever the number
+        of versions and instances. A document holds the fields of the tool, the labels of its
+        EDAM operations and its versions from the newest, each with the sorted URLs of its instances.
+        """
+
+        tool_table = Tool.__table__
+        tool_version_table = ToolVersion.__table__
+
+        documents = {}
+        for ids in _chunks(tool_ids):
+            query = select([tool_table.c.id, tool_table.c.name, tool_table.c.display_name, tool_table.c.description, tool_table.c.link])
+            for row in db.session.execute(query.where(tool_table.c.id.in_(ids))):
+                documents[row.id] = {'id': row.id,
+                                     'name': row.name,
+                                     'display_name': row.display_name,
+                                     'description': row.description,
+                                     'link': row.link,
+                                     'topics': [],
+                                     'versions': []}
+
+            query = select([tool_edam_operation.c.tool_id, EDAMOperation.label])\
+                .select_from(tool_edam_operation.join(EDAMOperation.__table__))\
+                .where(tool_edam_operation.c.tool_id.in_(ids))\
+                .order_by(EDAMOperation.label)
+            for row in db.session.execute(query):
+                documents[row.tool_id]['topics'].append(row.label)
+
+            instances = {}
+            query = select([toolversion_instance.c.tool_version_id, Instance.url])\
+                .select_from(toolversion_instance.join(tool_version_table).join(Instance.__table__))\
+                .where(tool_version_table.c.tool_id.in_(ids))\
+                .order_by(Instance.url)
+            for row in db.session.execute(query):
+                instances.setdefault(row.tool_version_id, []).append(row.url)
+
+            query = select([tool_version_table.c.id, tool_version_table.c.tool_id, tool_version_table.c.version, tool_version_table.c.tool_shed,
+                            tool_version_table.c.owner, tool_version_table.c.changeset])\
+                .where(tool_version_table.c.tool_id.in_(ids))\
+                .order_by(tool_version_table.c.sort_key.desc(), tool_version_table.c.version.desc(), tool_version_table.c.id)
+            for row in db.session.execute(query):
+                documents[row.tool_id]['versions'].append({'version': row.version,
+                                                           'tool_shed': row.tool_shed,
+                                                           'owner': row.owner,
+                                                           'changeset': row.changeset,
+                                                           'instances': instances.get(row.id, [])})
+
+        return documents
+
+    @classmethod
+    def invalidate_documents(cls, tool_ids):
+        """ Drop the documents of ``tool_ids``, they are rebuilt by refresh_documents() """
+
+        for ids in _chunks(tool_ids):
+            db.session.execute(tool_document.delete().where(tool_document.c.tool_id.in_(ids)))
+
+    @classmethod
+    def refresh_documents(cls, chunk_size=500):
+        """ Build the documents of the tools which have none, ``chunk_size`` tools at a time. Returns the number of documents built """
+
+        query = select([Tool.__table__.c.id]).where(~Tool.__table__.c.id.in_(select([tool_document.c.tool_id])))
+        tool_ids = [row.id for row in db.session.execute(query)]
+
+        for ids in _chunks(tool_ids, chunk_size):
+            documents = Tool.build_documents(ids)
+            db.session.execute(tool_document.insert(), [{'tool_id': tool_id, 'document': json.dumps(document)}
+                                                        for tool_id, document in documents.iteritems()])
+
+        return len(tool_ids)
+
+    @classmethod
+    def get_document(cls, id):
+        """ Returns the detail document of a tool with a single read, or None when the tool does not exist """
+
+        document = db.session.execute(select([tool_document.c.document]).where(tool_document.c.tool_id == id)).scalar()
+        if document is not None:
+            return json.loads(document)
+
+        # not built yet, e.g. right after the migration
+        return Tool.build_documents([id]).get(id, None)
+
+    @classmethod
+    def update_catalog(cls, workers=None, timeout=None, edam_dump=None, edam_prefetch=False, stats=None):
+        """
+        Refresh every instance in a single transaction so that the webapp
+        keeps serving the previous catalog until the new one is complete.
+        Instances that cannot be reached or fail to be stored keep their previous
+        tools, instances being harvested by harvestd or another command are skipped.
+
+        Returns the HarvestStats of the refresh, ``stats`` can be given to
+        profile the instances.
+        """
+
+        from galaxycat.harvest import harvest_instances
+        from galaxycat.scheduler import acquire_lock, lock_owner, release_locks
+
+        if workers is None:
+            workers = app.config['HARVEST_WORKERS']
+        if timeout is None:
+            timeout = app.config['HARVEST_TIMEOUT']
+        if edam_dump is None:
+            edam_dump = app.config['EDAM_DUMP']
+
+        if stats is None:
+            stats = HarvestStats(db.engine)
+
+        with stats:
+            if edam_dump is not None or edam_prefetch:
+                with stats.catalog.stage('edam'):
+                    EDAMOperation.prefetch(dump=edam_dump)
+
+            owner = lock_owner()
+            with stats.catalog.stage('db'):
+                # acquire_lock() commits and expires the instances, read them first
+                instances = []
+                for instance in Instance.query.all():
+                    instance.cache_location()
+                    instances.append((instance.id, instance.url, instance.get_validators()))
+
+                urls = []
+                previous = {}
+                for instance_id, url, validators in instances:
+                    if acquire_lock(instance_id, owner, app.config['HARVESTD_LOCK_TTL']):
+                        urls.append(url)
+                        previous[url] = validators
+                    else:
+                        print "%s is being harvested elsewhere, skipped" % url
+            try:
+                changed = False
+                for instance_data in harvest_instances(urls, workers=workers, timeout=timeout, previous=previous,
+                                                       geo_cache=geo_cache, profile=stats.profile, session=get_http_session()):
+                    with stats.instance(instance_data) as instance_stats:
+                        savepoint = db.session.begin_nested()
+                        try:
+                            changed = Instance.store_instance(instance_data, commit=False, stats=instance_stats) or changed
+                            savepoint.commit()
+                        except Exception:
+                            # only this instance is rolled back, e.g. when harvestd added the same new tool first
+                            traceback.print_exc()
+                            savepoint.rollback()
+                            print "Unable to store %s, it keeps its previous tools" % instance_data.url
 
-        # delete all Tool and ToolVersion
-        for tool_version in ToolVersion.query.all():
-            tool_version.instances = []
-        ToolVersion.query.delete()
+                with stats.catalog.stage('db'):
+                    report = Tool.delete_orphans()
+                    print "%d orphan tools and %d orphan tool versions deleted" % (report['tool'], report['tool_version'])
 
-        for tool in Tool.query.all():
-            tool.edam_operations = []
-        Tool.query.delete()
+                    if changed or sum(report.values()) > 0:
+                        CatalogStatus.bump()
+                    db.session.commit()
+            except:
+                db.session.rollback()
+                raise
+            finally:
+                release_locks(owner)
 
-        db.session.commit()
+        return stats
 
-        for instance in Instance.query.all():
-            Instance.add_instance(url=instance.url)
+
+availability_index = None  # built on first use, then again for each new catalog generation
+availability_index_lock = threading.Lock()
+
+
+def load_availability_index(generation=None):
+
+    links = select([ToolVersion.tool_id, toolversion_instance.c.tool_version_id, toolversion_instance.c.instance_id])\
+        .select_from(toolversion_instance.join(ToolVersion.__table__))
+    operations = select([tool_edam_operation.c.tool_id, EDAMOperation.operation_id, EDAMOperation.label])\
+        .select_from(tool_edam_operation.join(EDAMOperation.__table__))
+    instances = select([Instance.id, Instance.brand])
+
+    return AvailabilityIndex.build(db.session.execute(links), db.session.execute(operations), db.session.execute(instances),
+                                   generation=generation)
+
+
+def get_availability_index():
+    """ Returns the AvailabilityIndex of the current catalog generation, or None when AVAILABILITY_INDEX is disabled """
+
+    global availability_index
+
+    if not app.config['AVAILABILITY_INDEX']:
+        return None
+
+    generation = CatalogStatus.get().generation
+    index = availability_index
+    if index is None or index.generation != generation:
+        with availability_index_lock:
+            if availability_index is None or availability_index.generation != generation:
+                availability_index = load_availability_index(generation)
+            index = availability_index
+
+    return index
+
+
+def _chunks(values, size=500):
+    """ Split ``values`` so that IN clauses stay below the bind parameter limit of the database """
+
+    values = list(values)
+    for start in xrange(0, len(values), size):
+        yield values[start:start + size]
 
 
 class Node(list):
@@ -284,6 +966,8 @@ class Node(list):
 
     @classmethod
     def group(cls, expr):
+        from pyparsing import Group
+
         def group_action(s, l, t):
             try:
                 lst = t[0].asList()
@@ -309,14 +993,52 @@ class ComparisonNode(Node):
     pass
 
 
-def parse_search_query(query):
+def build_search_grammar():
+
+    from pyparsing import Literal, OneOrMore, QuotedString, Regex
 
-    unicode_printables = u''.join(unichr(c) for c in xrange(65536) if not unichr(c).isspace())
-    word = TextNode.group(Word(unicode_printables))
+    # words are runs of non-space characters, a Word of every printable character would
+    # compile a character class of the whole BMP, which takes about half a second
+    word = TextNode.group(Regex(r'\S+', re.UNICODE))
     exact = ExactNode.group(QuotedString('"', unquoteResults=True, escChar='\\'))
     term = exact | word
-    comparison_name = Word(unicode_printables, excludeChars=':')
+    comparison_name = Regex(r'[^\s:]+', re.UNICODE)
     comparison = ComparisonNode.group(comparison_name + Literal(':') + term)
     content = OneOrMore(comparison | term)
 
-    return content.parseString(query)
+    return content
+
+
+search_grammar = None  # built on first use, so that pyparsing is only imported by searches
+parsed_search_queries = LRUCache(maxsize=app.config['SEARCH_QUERY_CACHE_SIZE'])
+
+
+def split_search_query(query):
+    """ Returns (terms, [(key, value)]) of ``query``, lower-cased, or None when it filters on an unknown key """
+
+    terms = []
+    comparisons = []
+    for node in parse_search_query(query):
+        if type(node) == ComparisonNode:
+            if node[0] not in (u"topic", u"instance"):
+                return None
+            comparisons.append((node[0], u" ".join(node[2]).lower()))
+        else:
+            terms.append(u" ".join(node).lower())
+
+    return terms, comparisons
+
+
+def parse_search_query(query):
+    """ Parse trees are cached by query and must not be modified by the caller """
+
+    global search_grammar
+
+    nodes = parsed_search_queries.get(query)
+    if nodes is None:
+        if search_grammar is None:
+            search_grammar = build_search_grammar()
+        nodes = search_grammar.parseString(query)
+        parsed_search_queries.set(query, nodes)
+
+    return nodes
@@ -1,10 +1,10 @@
 # coding=utf-8
 
 import click
+import json
 
-
-from galaxycat.app import db
-from galaxycat.catalog import EDAMOperation, Instance, Tool, ToolVersion  # NOQA
+# each command imports what it needs, so that --help and the commands which do not
+# harvest never load bioblend, and galaxycat.catalog is loaded after galaxycat.app
 
 
 @click.group()
@@ -14,18 +14,79 @@ def cli():
 
 @cli.command(help="Create the GalaxyCat SQL database")
 def create_database():
+    from galaxycat.app import app, db
+    from galaxycat.fulltext import create_search_index
     db.create_all()
+    search_index = create_search_index(db, app.config['SEARCH_BACKEND'])
+    if search_index is not None:
+        search_index.create()
+        db.session.commit()
+
+
+@cli.command(help="Rebuild the full-text search index")
+def rebuild_search_index():
+    from galaxycat.app import app, db
+    from galaxycat.fulltext import create_search_index
+    search_index = create_search_index(db, app.config['SEARCH_BACKEND'])
+    if search_index is None:
+        print "The database does not support full-text search, searches use ILIKE"
+        return
+    search_index.drop()
+    search_index.create()
+    search_index.rebuild()
+    db.session.commit()
+
+
+@cli.command(help="Rebuild the detail documents of the tools")
+def rebuild_tool_documents():
+    from galaxycat.app import db
+    from galaxycat.catalog import Tool, tool_document
+    db.session.execute(tool_document.delete())
+    print "%d tool documents built" % Tool.refresh_documents()
+    db.session.commit()
 
 
 @cli.command(help="Add a Galaxy instance to the catalog")
 @click.option('--url', prompt='Galaxy URL', help='Galaxy instance url to add to the catalog')
 def add_instance(url):
+    from galaxycat.app import app  # NOQA
+    from galaxycat.catalog import Instance
     Instance.add_instance(url=url)
 
 
 @cli.command(help="Update the catalog")
-def update_catalog():
-    Tool.update_catalog()
+@click.option('--workers', type=int, default=None, help='Number of Galaxy instances fetched at once')
+@click.option('--timeout', type=float, default=None, help='Seconds to wait for a Galaxy instance before giving up')
+@click.option('--edam-dump', type=click.Path(exists=True, dir_okay=False), default=None, help='EDAM.tsv or EDAM.owl file to load EDAM operations from')
+@click.option('--edam-prefetch', is_flag=True, help='Load every EDAM operation from OLS before harvesting')
+@click.option('--report', type=click.Path(dir_okay=False, writable=True), default=None, help='JSON file to write the timings of the harvest to')
+@click.option('--profile', type=click.Path(file_okay=False, writable=True), default=None, help='Directory to write a cProfile profile of each instance to')
+def update_catalog(workers, timeout, edam_dump, edam_prefetch, report, profile):
+    from galaxycat.app import db
+    from galaxycat.catalog import Tool
+    from galaxycat.instrument import HarvestStats
+    stats = Tool.update_catalog(workers=workers, timeout=timeout, edam_dump=edam_dump, edam_prefetch=edam_prefetch,
+                                stats=HarvestStats(db.engine, profile_dir=profile))
+    print stats.summary()
+    if report is not None:
+        stats.write_json(report)
+
+
+@cli.command(help="Refresh the catalog continuously, each instance on its own schedule")
+@click.option('--workers', type=int, default=None, help='Number of Galaxy instances fetched at once')
+@click.option('--timeout', type=float, default=None, help='Seconds to wait for a Galaxy instance before giving up')
+@click.option('--edam-dump', type=click.Path(exists=True, dir_okay=False), default=None, help='EDAM.tsv or EDAM.owl file to load EDAM operations from')
+def harvestd(workers, timeout, edam_dump):
+    from galaxycat.app import app
+    from galaxycat.scheduler import HarvestDaemon
+    HarvestDaemon(workers=workers, timeout=timeout).run(edam_dump=edam_dump or app.config['EDAM_DUMP'])
+
+
+@cli.command(help="Show the harvests due, in flight and scheduled for the next hours")
+def harvest_status():
+    from galaxycat.app import app  # NOQA
+    from galaxycat.scheduler import harvest_status as get_harvest_status
+    print json.dumps(get_harvest_status(), indent=2, sort_keys=True)
 
 
 @cli.command(help="Serve the GalaxyCat webapp (not suitable for production)")
@@ -39,5 +100,40 @@ def serve(host, port):
 @cli.command(help="Search the catalog")
 @click.option('--search', prompt='Tool name', help='The tool to search for')
 def search(search):
-    for tool in Tool.search(search):
+    from galaxycat.app import app  # NOQA
+    from galaxycat.catalog import Tool
+    query = Tool.search_query(search)
+    if query is None:
+        return
+    for tool in query.yield_per(500):
         print tool.name
+
+
+@cli.command(help="List the instances running an older version of a tool than the newest one in the catalog")
+@click.option('--output', type=click.File('wb'), default='-', help='File to write the report to, standard output by default')
+@click.option('--csv', 'as_csv', is_flag=True, help='Write the report as CSV')
+def version_drift(output, as_csv):
+    from galaxycat.app import app  # NOQA
+    from galaxycat.drift import get_version_drift, group_by_tool, write_csv
+    rows = get_version_drift().rows
+    if as_csv:
+        write_csv(rows, output)
+        return
+    for tool_id, name, newest_version, newest_changeset, instances in group_by_tool(rows):
+        output.write((u"%s %s\n" % (name, newest_version)).encode('utf-8'))
+        for row in instances:
+            output.write((u"    %s %s (%d behind)\n" % (row.instance, row.version, row.versions_behind)).encode('utf-8'))
+
+
+@cli.command(help="Export the tool/version/instance matrix as NDJSON")
+@click.option('--output', type=click.File('wb'), default='-', help='File to write the export to, standard output by default')
+@click.option('--gzip', 'compress', is_flag=True, help='Compress the export with gzip')
+def export(output, compress):
+    # galaxycat.api is imported by galaxycat.app once the app is set up
+    from galaxycat.app import app  # NOQA
+    from galaxycat.api import gzip_stream, iter_export
+    chunks = iter_export()
+    if compress:
+        chunks = gzip_stream(chunks)
+    for chunk in chunks:
+        output.write(chunk)
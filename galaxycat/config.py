@@ -20,10 +20,51 @@ class DefaultConfig:
     BABEL_DEFAULT_LOCALE = 'en'
     BABEL_DEFAULT_TIMEZONE = 'UTC+1'
 
+    JSONIFY_PRETTYPRINT_REGULAR = False
+
     # App config
     SQLALCHEMY_DATABASE_URI = None
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     GOOGLE_ANALYTICS_UA = None
+    SEARCH_BACKEND = 'auto'  # 'auto' picks the full-text index of the database, 'like' disables it
+    SEARCH_QUERY_CACHE_SIZE = 1024  # number of parsed search queries kept in memory
+    SEARCH_PER_PAGE = 50
+    SEARCH_MAX_PER_PAGE = 200
+    AVAILABILITY_INDEX = True  # keep which tools are available where in memory, rebuilt after each harvest
+    AVAILABILITY_INDEX_MAX_IDS = 500  # search filters matching more tools are left to the database
+
+    # Rendered pages are cached until the next harvest, any class with get(key) and set(key, value) can be used
+    PAGE_CACHE_BACKEND = 'galaxycat.cache.LRUCache'
+    PAGE_CACHE_OPTIONS = {'maxsize': 1024}
+
+    # Request metrics exposed on /metrics in the Prometheus text format
+    METRICS_ENABLED = False
+    METRICS_SLOW_QUERY_THRESHOLD = None  # seconds, slower SQL statements are logged
+    METRICS_SERVER_TIMING = False  # add a Server-Timing header with the SQL and render times of each response
+
+    # Harvesting config
+    HARVEST_WORKERS = 8  # number of Galaxy instances fetched at once
+    HARVEST_TIMEOUT = 60  # seconds to wait for a Galaxy instance before giving up
+    HARVEST_CHUNK_SIZE = 1000  # tools of an instance written to the database at once
+    HTTP_CONNECT_TIMEOUT = 10  # seconds to wait for a connection to a Galaxy instance, OLS or ip-api.com
+    HTTP_RETRIES = 3  # retries of a failed connection or of a 429, 500, 502, 503 or 504 answer
+    HTTP_BACKOFF_FACTOR = 0.5  # seconds before the first retry, doubled before each next one
+    EDAM_DUMP = None  # path to an EDAM.tsv or EDAM.owl file loaded before harvesting
+    EDAM_MISS_TTL = 86400  # seconds before an EDAM id unknown to OLS is looked up again
+    GEOIP_DATABASE = None  # path to a MaxMind City database (.mmdb), instances are then located without ip-api.com
+    GEOIP_TIMEOUT = 10  # seconds to wait for the location of an instance
+    GEOIP_CACHE_TTL = 2592000  # seconds before the location of a host is looked up again
+
+    # Continuous harvest (galaxycat harvestd), intervals are in seconds
+    HARVESTD_INTERVAL = 86400  # first interval of an instance, then adapted to how often its tools change
+    HARVESTD_MIN_INTERVAL = 3600
+    HARVESTD_MAX_INTERVAL = 604800
+    HARVESTD_RETRY_INTERVAL = 600  # first retry of a failing instance, doubled after each failure
+    HARVESTD_DURATION_FACTOR = 100  # an instance is not refreshed more often than 100 times its harvest duration
+    HARVESTD_JITTER = 0.1  # intervals are spread by +/- 10%
+    HARVESTD_LOCK_TTL = 3600  # a harvest lock older than this is considered abandoned
+    HARVESTD_POLL_INTERVAL = 5  # seconds between two looks at the due instances
+    HARVESTD_CLEANUP_INTERVAL = 3600  # seconds between two deletions of orphan tools
 
     # Logging standard configuration : override default Flask logging
     # https://docs.python.org/2/library/logging.config.html#logging.config.dictConfig
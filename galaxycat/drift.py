@@ -0,0 +1,98 @@
+# coding=utf-8
+
+""" Version drift: the instances running an older version of a tool than the newest one seen in the catalog """
+
+import csv
+import threading
+
+from collections import namedtuple
+from galaxycat.app import db
+from galaxycat.catalog import CatalogStatus, Instance, Tool, ToolVersion, toolversion_instance
+from sqlalchemy import func, select
+
+
+DRIFT_COLUMNS = ['tool', 'newest_version', 'newest_changeset', 'instance', 'version', 'changeset', 'versions_behind']
+
+DriftRow = namedtuple('DriftRow', ['tool_id'] + DRIFT_COLUMNS)
+
+VersionDrift = namedtuple('VersionDrift', ['generation', 'rows'])
+
+
+def drift_query():
+    """
+    For every tool available on an instance, the newest version of the tool next to the
+    newest version the instance has, when it is older. Versions are ranked per tool by
+    the database with window functions, from the greatest ``sort_key`` (1.10 after 1.9)
+    like the tool page lists them, then from the last seen tool version for the same
+    version.
+    """
+
+    tool_version_table = ToolVersion.__table__
+    newest_first = [tool_version_table.c.sort_key.desc(), tool_version_table.c.version.desc(), tool_version_table.c.id.desc()]
+    ranked = select([tool_version_table.c.tool_id,
+                     toolversion_instance.c.instance_id,
+                     tool_version_table.c.version,
+                     tool_version_table.c.changeset,
+                     func.dense_rank().over(partition_by=tool_version_table.c.tool_id,
+                                            order_by=tool_version_table.c.sort_key.desc()).label('version_rank'),
+                     func.row_number().over(partition_by=[tool_version_table.c.tool_id, toolversion_instance.c.instance_id],
+                                            order_by=newest_first).label('instance_rank'),
+                     func.first_value(tool_version_table.c.version).over(partition_by=tool_version_table.c.tool_id,
+                                                                         order_by=newest_first).label('newest_version'),
+                     func.first_value(tool_version_table.c.changeset).over(partition_by=tool_version_table.c.tool_id,
+                                                                           order_by=newest_first).label('newest_changeset')])\
+        .select_from(toolversion_instance.join(tool_version_table))\
+        .cte('ranked')
+
+    # instance_rank 1 is the newest version of the tool on the instance, version_rank 1 the newest version of the tool
+    return select([Tool.id, Tool.name, ranked.c.newest_version, ranked.c.newest_changeset, Instance.url,
+                   ranked.c.version, ranked.c.changeset, (ranked.c.version_rank - 1).label('versions_behind')])\
+        .select_from(ranked.join(Tool.__table__, Tool.id == ranked.c.tool_id)
+                           .join(Instance.__table__, Instance.id == ranked.c.instance_id))\
+        .where(ranked.c.instance_rank == 1)\
+        .where(ranked.c.version_rank > 1)\
+        .order_by(Tool.name, ranked.c.version_rank.desc(), Instance.url)
+
+
+def load_version_drift(generation=None):
+
+    return VersionDrift(generation, [DriftRow(*row) for row in db.session.execute(drift_query())])
+
+
+version_drift = None  # computed on first use, then again for each new catalog generation
+version_drift_lock = threading.Lock()
+
+
+def get_version_drift():
+    """ Returns the VersionDrift of the current catalog generation, rows are ordered by tool name """
+
+    global version_drift
+
+    generation = CatalogStatus.get().generation
+    drift = version_drift
+    if drift is None or drift.generation != generation:
+        with version_drift_lock:
+            if version_drift is None or version_drift.generation != generation:
+                version_drift = load_version_drift(generation)
+            drift = version_drift
+
+    return drift
+
+
+def group_by_tool(rows):
+    """ Returns [(tool id, tool name, newest version, newest changeset, rows of the lagging instances)] """
+
+    tools = []
+    for row in rows:
+        if not tools or tools[-1][0] != row.tool_id:
+            tools.append((row.tool_id, row.tool, row.newest_version, row.newest_changeset, []))
+        tools[-1][4].append(row)
+    return tools
+
+
+def write_csv(rows, output):
+
+    writer = csv.writer(output)
+    writer.writerow(DRIFT_COLUMNS)
+    for row in rows:
+        writer.writerow([value.encode('utf-8') if isinstance(value, unicode) else value for value in row[1:]])
@@ -0,0 +1,175 @@
+# coding=utf-8
+
+""" Resolves EDAM operation ids to their label and description """
+
+import csv
+import time
+import urllib
+
+from functools import partial
+from multiprocessing.pool import ThreadPool
+from xml.etree import cElementTree as ElementTree
+
+
+EDAM_IRI = 'http://edamontology.org/%s'
+OLS_TERM_URL = 'http://www.ebi.ac.uk/ols/api/ontologies/edam/terms/%s'
+OLS_TERMS_URL = 'http://www.ebi.ac.uk/ols/api/ontologies/edam/terms'
+
+RDF_ABOUT = '{http://www.w3.org/1999/02/22-rdf-syntax-ns#}about'
+OWL_CLASS = '{http://www.w3.org/2002/07/owl#}Class'
+RDFS_LABEL = '{http://www.w3.org/2000/01/rdf-schema#}label'
+OBO_DEFINITION = '{http://www.geneontology.org/formats/oboInOwl#}hasDefinition'
+
+
+def make_term(iri, label, description):
+
+    return {'operation_id': iri.rsplit('/', 1)[-1],
+            'iri': iri,
+            'label': label,
+            'description': description}
+
+
+def is_operation(iri):
+    return iri is not None and iri.startswith(EDAM_IRI % 'operation_')
+
+
+def fetch_term(operation_id, timeout=None, session=None):
+    """
+    Ask OLS for a single EDAM operation, returns (operation_id, term or None, unknown).
+    ``unknown`` is True only when OLS answers that it does not know the id, not when
+    OLS cannot be reached or fails to answer.
+    """
+
+    # requests is only imported by the harvest, not by the webapp
+    from requests.exceptions import RequestException
+
+    if session is None:
+        from galaxycat.http import get_session
+        session = get_session()
+
+    iri = EDAM_IRI % operation_id
+    api_url = OLS_TERM_URL % urllib.quote(urllib.quote(iri, safe=''), safe='')
+    try:
+        edam_response = session.get(api_url, timeout=timeout)
+    except RequestException:
+        print "Unable to get EDAM operation %s" % operation_id
+        return operation_id, None, False
+
+    if edam_response.status_code == 404:
+        return operation_id, None, True
+    if edam_response.status_code != 200:
+        print "Unable to get EDAM operation %s, OLS answered %d" % (operation_id, edam_response.status_code)
+        return operation_id, None, False
+
+    try:
+        edam_data = edam_response.json()
+    except ValueError:
+        print "Unable to decode EDAM operation %s" % operation_id
+        return operation_id, None, False
+
+    return operation_id, make_term(iri, edam_data['label'], " ".join(edam_data.get('description') or [])), False
+
+
+class EDAMResolver(object):
+    """
+    In-process map of EDAM operations.
+
+    Ids that OLS does not know are remembered for ``miss_ttl`` seconds so
+    that they are not looked up again on every harvest, ids OLS failed to
+    answer for are looked up again by the next resolve(). OLS is requested
+    through the session returned by ``get_session``, galaxycat.http.get_session
+    by default, called on first use.
+    """
+
+    def __init__(self, miss_ttl=86400, workers=8, timeout=None, get_session=None):
+        self.miss_ttl = miss_ttl
+        self.workers = workers
+        self.timeout = timeout
+        self.get_session = get_session
+        self.terms = {}
+        self.misses = {}
+
+    @property
+    def session(self):
+        if self.get_session is None:
+            from galaxycat.http import get_session
+            return get_session()
+        return self.get_session()
+
+    def add(self, term):
+        self.terms[term['operation_id']] = term
+        self.misses.pop(term['operation_id'], None)
+
+    def is_missing(self, operation_id):
+        expiry = self.misses.get(operation_id, None)
+        if expiry is None:
+            return False
+        if expiry < time.time():
+            del self.misses[operation_id]
+            return False
+        return True
+
+    def unresolved(self, operation_ids):
+        """ Ids among ``operation_ids`` neither known nor known to be unknown to OLS, their last lookup failed """
+
+        return set(operation_id for operation_id in operation_ids
+                   if operation_id not in self.terms and not self.is_missing(operation_id))
+
+    def load_tsv(self, path):
+        """ Load the EDAM.tsv dump published by the EDAM project """
+
+        with open(path, 'rb') as dump:
+            for row in csv.DictReader(dump, delimiter='\t'):
+                if is_operation(row.get('Class ID')) and row.get('Obsolete', 'FALSE').upper() != 'TRUE':
+                    self.add(make_term(row['Class ID'].decode('utf-8'),
+                                       row['Preferred Label'].decode('utf-8'),
+                                       (row.get('Definitions') or '').decode('utf-8')))
+
+    def load_owl(self, path):
+        """ Load the EDAM.owl dump published by the EDAM project """
+
+        for event, element in ElementTree.iterparse(path):
+            if element.tag == OWL_CLASS:
+                iri = element.get(RDF_ABOUT)
+                label = element.findtext(RDFS_LABEL)
+                if is_operation(iri) and label is not None:
+                    self.add(make_term(iri, label, element.findtext(OBO_DEFINITION) or u''))
+                element.clear()
+
+    def load_dump(self, path):
+        if path.endswith('.owl'):
+            self.load_owl(path)
+        else:
+            self.load_tsv(path)
+
+    def load_ols(self, page_size=500):
+        """ Load every EDAM operation from OLS with a few paginated requests """
+
+        page = 0
+        total_pages = 1
+        while page < total_pages:
+            response = self.session.get(OLS_TERMS_URL, params={'size': page_size, 'page': page}, timeout=self.timeout)
+            response.raise_for_status()
+            data = response.json()
+            for term in data.get('_embedded', {}).get('terms', []):
+                if is_operation(term.get('iri')):
+                    self.add(make_term(term['iri'], term['label'], " ".join(term.get('description') or [])))
+            total_pages = data['page']['totalPages']
+            page += 1
+
+    def resolve(self, operation_ids):
+        """ Returns a dict of the known terms among ``operation_ids``, unknown ids are fetched concurrently from OLS """
+
+        unknown = self.unresolved(operation_ids)
+        if unknown:
+            pool = ThreadPool(processes=min(self.workers, len(unknown)))
+            try:
+                for operation_id, term, missing in pool.imap_unordered(partial(fetch_term, timeout=self.timeout, session=self.session), unknown):
+                    if term is not None:
+                        self.add(term)
+                    elif missing:
+                        self.misses[operation_id] = time.time() + self.miss_ttl
+            finally:
+                pool.terminate()
+
+        return dict((operation_id, self.terms[operation_id]) for operation_id in operation_ids if operation_id in self.terms)
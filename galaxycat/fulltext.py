@@ -0,0 +1,198 @@
+# coding=utf-8
+
+""" Full-text index of the tools, backed by PostgreSQL tsvector and pg_trgm or SQLite FTS5 """
+
+import re
+
+from sqlalchemy import Column, Float, Integer, MetaData, Table, Unicode, func, literal, literal_column, or_, select, type_coerce
+from sqlalchemy.dialects.postgresql import TSVECTOR
+
+
+TOKEN = re.compile(r'\w+', re.UNICODE)
+
+# columns of the tool table searched for substrings
+SEARCH_COLUMNS = ('name', 'display_name', 'description')
+
+
+def tokenize(text):
+    return TOKEN.findall(text.lower())
+
+
+class SearchIndex(object):
+    """
+    Base class of the full-text indexes. Their tables are kept out of
+    db.Model.metadata because their DDL is specific to each database.
+    """
+
+    table_name = 'tool_search'
+
+    def __init__(self, db):
+        self.db = db
+
+    @property
+    def tool_table(self):
+        return self.db.Model.metadata.tables['tool']
+
+    def exists(self):
+        return self.db.engine.dialect.has_table(self.db.session.connection(), self.table_name)
+
+    def create(self):
+        raise NotImplementedError()
+
+    def drop(self):
+        self.db.session.execute('DROP TABLE IF EXISTS %s' % self.table_name)
+
+    def insert(self, tool_ids):
+        raise NotImplementedError()
+
+    def can_match(self, term):
+        """ Whether match() can look ``term`` up, the other terms are searched with ILIKE """
+
+        return True
+
+    def match(self, terms):
+        """
+        Returns a selectable of (tool_id, score) for the tools whose name, display name
+        or description contains every term of ``terms``, like ILIKE '%term%' finds them.
+        A higher score means a more relevant tool.
+        """
+        raise NotImplementedError()
+
+    def update(self, tool_ids):
+        """ Re-index ``tool_ids``, must run in the transaction that modified the tools """
+
+        tool_ids = list(tool_ids)
+        for start in xrange(0, len(tool_ids), 500):
+            chunk = tool_ids[start:start + 500]
+            self.db.session.execute(self.table.delete().where(self.tool_id_column.in_(chunk)))
+            self.insert(chunk)
+
+    def delete_orphans(self):
+        self.db.session.execute(self.table.delete().where(~self.tool_id_column.in_(select([self.tool_table.c.id]))))
+
+    def rebuild(self):
+        self.db.session.execute(self.table.delete())
+        self.insert(None)
+
+
+class PostgreSQLSearchIndex(SearchIndex):
+
+    table = Table('tool_search', MetaData(),
+                  Column('tool_id', Integer, primary_key=True),
+                  Column('document', TSVECTOR, nullable=False))
+
+    @property
+    def tool_id_column(self):
+        return self.table.c.tool_id
+
+    def create(self):
+        self.db.session.execute('CREATE TABLE IF NOT EXISTS tool_search ('
+                                'tool_id INTEGER PRIMARY KEY REFERENCES tool (id) ON DELETE CASCADE, '
+                                'document TSVECTOR NOT NULL)')
+        self.db.session.execute('CREATE INDEX IF NOT EXISTS ix_tool_search_document ON tool_search USING gin (document)')
+        # ILIKE '%term%' on the tool columns goes through trigram indexes
+        self.db.session.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        for column in SEARCH_COLUMNS:
+            self.db.session.execute('CREATE INDEX IF NOT EXISTS ix_tool_%s_trgm ON tool USING gin (%s gin_trgm_ops)' % (column, column))
+
+    def insert(self, tool_ids):
+        tool = self.tool_table
+
+        def weighted(column, weight):
+            return func.setweight(func.to_tsvector('simple', func.coalesce(column, u'')), weight)
+
+        document = weighted(tool.c.name, 'A').op('||')(weighted(tool.c.display_name, 'A')).op('||')(weighted(tool.c.description, 'B'))
+        query = select([tool.c.id, document])
+        if tool_ids is not None:
+            query = query.where(tool.c.id.in_(tool_ids))
+        self.db.session.execute(self.table.insert().from_select(['tool_id', 'document'], query))
+
+    def match(self, terms):
+        tool = self.tool_table
+        query = select([tool.c.id.label('tool_id')]).select_from(tool.outerjoin(self.table, self.table.c.tool_id == tool.c.id))
+        for term in terms:
+            pattern = u'%{0}%'.format(term)
+            query = query.where(or_(*[tool.c[column].ilike(pattern) for column in SEARCH_COLUMNS]))
+
+        # tools whose words start with the terms rank first, words of a quoted term must follow each other
+        tokens = [tokenize(term) for term in terms]
+        tsquery = u' & '.join(u'(%s)' % u' <-> '.join(u"'%s':*" % token for token in term_tokens) for term_tokens in tokens if term_tokens)
+        if tsquery:
+            score = func.coalesce(func.ts_rank(self.table.c.document, func.to_tsquery('simple', tsquery)), 0.0)
+        else:
+            score = literal(0.0)
+
+        return query.column(score.label('score')).alias('fulltext')
+
+
+class SQLiteSearchIndex(SearchIndex):
+
+    table = Table('tool_search', MetaData(),
+                  Column('rowid', Integer, primary_key=True),
+                  Column('name', Unicode),
+                  Column('display_name', Unicode),
+                  Column('description', Unicode))
+
+    @property
+    def tool_id_column(self):
+        return self.table.c.rowid
+
+    @classmethod
+    def is_supported(cls, db):
+        # the trigram tokenizer of FTS5 comes with SQLite 3.34
+        version = tuple(int(part) for part in db.session.execute('SELECT sqlite_version()').scalar().split('.'))
+        return version >= (3, 34) and bool(db.session.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')").scalar())
+
+    def create(self):
+        self.db.session.execute("CREATE VIRTUAL TABLE IF NOT EXISTS tool_search USING fts5(name, display_name, description, tokenize='trigram')")
+
+    def can_match(self, term):
+        # shorter terms have no trigram
+        return len(term) >= 3
+
+    def insert(self, tool_ids):
+        tool = self.tool_table
+        query = select([tool.c.id, tool.c.name, func.coalesce(tool.c.display_name, u''), func.coalesce(tool.c.description, u'')])
+        if tool_ids is not None:
+            query = query.where(tool.c.id.in_(tool_ids))
+        self.db.session.execute(self.table.insert().from_select(['rowid', 'name', 'display_name', 'description'], query))
+
+    def match(self, terms):
+        # the trigrams of "bed file" match the columns containing "bed file"
+        fts_query = u' AND '.join(u'"%s"' % term.replace(u'"', u'""') for term in terms)
+        fts_table = literal_column(self.table_name)
+
+        return select([self.table.c.rowid.label('tool_id'), type_coerce(-func.bm25(fts_table, 10.0, 10.0, 1.0), Float).label('score')])\
+            .where(fts_table.match(fts_query))\
+            .alias('fulltext')
+
+
+def create_search_index(db, backend='auto'):
+    """ Returns the SearchIndex supported by the database, or None when searches must fall back to ILIKE """
+
+    if backend == 'like':
+        return None
+
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql' and backend in ('auto', 'postgresql'):
+        return PostgreSQLSearchIndex(db)
+    if dialect == 'sqlite' and backend in ('auto', 'sqlite') and SQLiteSearchIndex.is_supported(db):
+        return SQLiteSearchIndex(db)
+
+    return None
+
+
+_search_indexes = {}
+
+
+def get_search_index(db, backend='auto'):
+    """ Same as create_search_index, but only returns an index whose table exists. The answer is cached per process """
+
+    key = (str(db.engine.url), backend)
+    if key not in _search_indexes:
+        search_index = create_search_index(db, backend)
+        if search_index is not None and not search_index.exists():
+            search_index = None
+        _search_indexes[key] = search_index
+
+    return _search_indexes[key]
@@ -0,0 +1,156 @@
+# coding=utf-8
+
+""" Resolves the host of a Galaxy instance to its location, online with ip-api or offline with a MaxMind database """
+
+import socket
+import threading
+import time
+
+from multiprocessing.pool import ThreadPool
+
+try:
+    import maxminddb
+except ImportError:
+    maxminddb = None
+
+
+IP_API_URL = 'http://ip-api.com/json/%s'
+
+
+class IPAPIResolver(object):
+    """ Asks ip-api.com, which is rate-limited, for every lookup, through the session returned by ``get_session`` """
+
+    def __init__(self, timeout=None, get_session=None):
+        self.timeout = timeout
+        self.get_session = get_session
+
+    @property
+    def session(self):
+        if self.get_session is None:
+            from galaxycat.http import get_session
+            return get_session()
+        return self.get_session()
+
+    def lookup(self, host):
+        # requests is only imported by the harvest, not by the webapp
+        from requests.exceptions import RequestException
+
+        try:
+            response = self.session.get(IP_API_URL % host, timeout=self.timeout)
+        except RequestException:
+            print "Unable to get location data for %s" % host
+            return None
+
+        try:
+            location = response.json()
+        except ValueError:
+            print "Unable to decode location data for %s" % host
+            return None
+
+        if location.get('status', 'success') != 'success':
+            print "Unable to get location data for %s: %s" % (host, location.get('message', 'unknown error'))
+            return None
+
+        return location
+
+
+class MaxMindResolver(object):
+    """ Looks hosts up in a local MaxMind database (GeoLite2-City.mmdb or GeoIP2-City.mmdb), needs the maxminddb package """
+
+    def __init__(self, path):
+        if maxminddb is None:
+            raise RuntimeError("The maxminddb package is required to read %s" % path)
+        self.reader = maxminddb.open_database(path)
+
+    def lookup(self, host):
+        try:
+            record = self.reader.get(socket.gethostbyname(host))
+        except (socket.error, ValueError):
+            print "Unable to get location data for %s" % host
+            return None
+
+        if record is None:
+            return None
+
+        # same keys as ip-api.com
+        location = record.get('location', {})
+        return {'city': record.get('city', {}).get('names', {}).get('en', None),
+                'zip': record.get('postal', {}).get('code', None),
+                'country': record.get('country', {}).get('names', {}).get('en', None),
+                'countryCode': record.get('country', {}).get('iso_code', None),
+                'lat': location.get('latitude', None),
+                'lon': location.get('longitude', None)}
+
+
+def create_resolver(database=None, timeout=None, get_session=None):
+    """ Returns a MaxMindResolver when a database file is configured, an IPAPIResolver otherwise """
+
+    if database is not None:
+        return MaxMindResolver(database)
+    return IPAPIResolver(timeout=timeout, get_session=get_session)
+
+
+class GeoCache(object):
+    """
+    Locations by host, looked up at most once every ``ttl`` seconds.
+
+    Lookups run in a small thread pool so that they can overlap with the
+    requests made to the Galaxy instances, ``timeout`` bounds the time
+    spent waiting for them.
+    """
+
+    def __init__(self, resolver, ttl=2592000, workers=4, timeout=None):
+        self.resolver = resolver
+        self.ttl = ttl
+        self.timeout = timeout
+        self.workers = workers
+        self.locations = {}
+        self.host_locks = {}
+        self.lock = threading.Lock()
+        self.pool = None
+
+    def add(self, host, location, timestamp=None):
+        """ Remember the location of ``host``, e.g. from the database, ``timestamp`` is when it was looked up """
+
+        if timestamp is None:
+            timestamp = time.time()
+        with self.lock:
+            self.locations[host] = (location, timestamp + self.ttl)
+
+    def get(self, host):
+        with self.lock:
+            location, expiry = self.locations.get(host, (None, 0))
+        if expiry < time.time():
+            return None
+        return location
+
+    def lookup(self, host):
+        """ Instances on the same host wait for a single lookup """
+
+        with self.lock:
+            host_lock = self.host_locks.setdefault(host, threading.Lock())
+
+        with host_lock:
+            location = self.get(host)
+            if location is None:
+                location = self.resolver.lookup(host)
+                if location is not None:
+                    self.add(host, location)
+        return location
+
+    def timed_lookup(self, host):
+        start = time.time()
+        location = self.lookup(host)
+        return location, time.time() - start
+
+    def lookup_async(self, host):
+        """ Returns an AsyncResult of (location of ``host``, seconds spent looking it up) """
+
+        with self.lock:
+            if self.pool is None:
+                self.pool = ThreadPool(processes=self.workers)
+        return self.pool.apply_async(self.timed_lookup, (host,))
+
+    def clear(self):
+        with self.lock:
+            self.locations.clear()
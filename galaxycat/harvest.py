@@ -0,0 +1,270 @@
+# coding=utf-8
+
+""" Fetches configuration, location and tools of many Galaxy instances at once """
+
+import cProfile
+import Queue
+import requests
+import socket
+import threading
+import time
+import traceback
+
+from bioblend import ConnectionError
+from bioblend.galaxy import GalaxyInstance
+from collections import namedtuple
+from contextlib import contextmanager
+from galaxycat.http import get_session
+from galaxycat.toolindex import index_tools, iter_elements
+from itertools import islice
+from multiprocessing import cpu_count, TimeoutError
+from multiprocessing.pool import ThreadPool
+from urlparse import urlparse
+
+
+InstanceData = namedtuple('InstanceData', ['url', 'config', 'location', 'tools', 'error',
+                                           'fingerprint', 'etag', 'last_modified', 'not_modified', 'duration',
+                                           'timings', 'profile'])
+
+
+class HarvestTimeout(Exception):
+    """ Raised when an instance takes longer than the timeout of the harvest, however steadily its server answers """
+
+
+class HarvestGalaxyInstance(GalaxyInstance):
+    """ A GalaxyInstance whose requests go through a HarvestSession and never wait more than ``timeout`` seconds for a server """
+
+    def __init__(self, url, timeout=None, session=None, **kwargs):
+        super(HarvestGalaxyInstance, self).__init__(url=url, **kwargs)
+        self.timeout = timeout
+        self.session = session if session is not None else get_session()
+
+    def make_get_request(self, url, **kwargs):
+        # same as GalaxyInstance.make_get_request, which calls requests.get
+        params = kwargs.get('params')
+        if params is not None and params.get('key', False) is False:
+            params['key'] = self.key
+        else:
+            params = self.default_params
+        kwargs['params'] = params
+        kwargs.setdefault('verify', self.verify)
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session.get(url, **kwargs)
+
+
+def parse_config(instance_config):
+    """ Map the configuration of a Galaxy instance to Instance columns, raises KeyError on incomplete configuration """
+
+    return {
+        'allow_user_creation': instance_config['allow_user_creation'],
+        'brand': instance_config['brand'],
+        'enable_quotas': 'enable_quotas' in instance_config and instance_config['enable_quotas'],
+        'require_login': 'require_login' in instance_config and instance_config['require_login'],
+        'terms_url': instance_config['terms_url'],
+        'version': instance_config['version_major'],
+    }
+
+
+def get_header(response, name, default=None):
+
+    value = response.headers.get(name, None)
+    if value is None:
+        return default
+    return value.decode('latin-1')
+
+
+def remaining(deadline):
+    """ Seconds left before ``deadline``, raises HarvestTimeout once it is past """
+
+    if deadline is None:
+        return None
+    seconds = deadline - time.time()
+    if seconds <= 0:
+        raise HarvestTimeout("Gave up after the harvest timeout")
+    return seconds
+
+
+def until(elements, deadline):
+    """ Yields ``elements`` until ``deadline``, then raises HarvestTimeout """
+
+    for element in elements:
+        remaining(deadline)
+        yield element
+
+
+def abort_response(response):
+    """ Shut the connection of a streamed ``response`` down, a read blocked on a server sending a byte now and then returns at once """
+
+    sock = getattr(getattr(response.raw, 'connection', None), 'sock', None)
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+
+
+def fetch_tools(galaxy_instance, version, etag=None, last_modified=None, deadline=None):
+    """
+    Returns (tool index, etag, last_modified), the tool index being None when the server answers 304 Not Modified.
+
+    The read timeout of the session only bounds the wait between two reads, the tool
+    list is given up with HarvestTimeout once ``deadline`` (a time.time()) is past.
+    """
+
+    headers = {}
+    if etag is not None:
+        headers['If-None-Match'] = etag
+    if last_modified is not None:
+        headers['If-Modified-Since'] = last_modified
+
+    response = galaxy_instance.make_get_request(galaxy_instance.url + '/tools', params={'in_panel': False}, headers=headers, stream=True,
+                                                timeout=remaining(deadline))
+    watchdog = None
+    if deadline is not None:
+        watchdog = threading.Timer(max(deadline - time.time(), 0), abort_response, (response,))
+        watchdog.daemon = True
+        watchdog.start()
+    try:
+        if response.status_code == 304:
+            return None, get_header(response, 'ETag', etag), get_header(response, 'Last-Modified', last_modified)
+
+        response.raise_for_status()
+        elements = iter_elements(response)
+        if deadline is not None:
+            elements = until(elements, deadline)
+        return index_tools(elements, version), get_header(response, 'ETag'), get_header(response, 'Last-Modified')
+    except HarvestTimeout:
+        raise
+    except Exception:
+        # the watchdog cut the download short
+        if deadline is not None and time.time() >= deadline:
+            raise HarvestTimeout("Gave up after the harvest timeout")
+        raise
+    finally:
+        if watchdog is not None:
+            watchdog.cancel()
+        response.close()
+
+
+def wait_location(location_result, timeout=None):
+    """ Returns (location, seconds spent looking it up) of a GeoCache.lookup_async result, the location is None if it is unknown or takes longer than ``timeout`` """
+
+    if location_result is None:
+        return None, 0.0
+    try:
+        return location_result.get(timeout)
+    except TimeoutError:
+        print "Location lookup timed out"
+        return None, timeout
+
+
+@contextmanager
+def timed(timings, name):
+
+    start = time.time()
+    try:
+        yield
+    finally:
+        timings[name] = time.time() - start
+
+
+def fetch_instance(url, timeout=None, previous=None, geo_cache=None, profile=False, session=None):
+    """
+    Download everything the catalog needs from a Galaxy instance without touching the database.
+
+    ``previous`` holds the ``version``, ``etag`` and ``last_modified`` stored by the
+    last harvest, they are used to download the tool list only if it has changed.
+    The location of the instance is looked up in ``geo_cache`` while Galaxy answers.
+    The instance is given up after ``timeout`` seconds in all, not only when its
+    server stops answering for ``timeout`` seconds.
+    Requests go through ``session``, a HarvestSession shared by the harvest.
+    With ``profile``, the download runs under cProfile and the profiler is returned
+    in InstanceData.profile.
+    """
+
+    start = time.time()
+    deadline = start + timeout if timeout is not None else None
+    profiler = cProfile.Profile() if profile else None
+    if profiler is not None:
+        profiler.enable()
+
+    timings = {}
+    instance_data = InstanceData(url=url, config=None, location=None, tools=None, error=None, fingerprint=None, etag=None,
+                                 last_modified=None, not_modified=False, duration=None, timings=timings, profile=profiler)
+    location_result = geo_cache.lookup_async(urlparse(url).hostname) if geo_cache is not None else None
+    try:
+        galaxy_instance = HarvestGalaxyInstance(url=url, timeout=timeout, session=session)
+        with timed(timings, 'config'):
+            instance_config = parse_config(galaxy_instance.config.get_config())
+
+        with timed(timings, 'tools'):
+            if previous is not None and previous['version'] == instance_config['version']:
+                tools, etag, last_modified = fetch_tools(galaxy_instance, instance_config['version'], previous['etag'], previous['last_modified'],
+                                                         deadline=deadline)
+            else:
+                tools, etag, last_modified = fetch_tools(galaxy_instance, instance_config['version'], deadline=deadline)
+
+        instance_location, timings['geo'] = wait_location(location_result, geo_cache.timeout if geo_cache is not None else None)
+
+        instance_data = instance_data._replace(config=instance_config, location=instance_location, etag=etag, last_modified=last_modified)
+        if tools is None:
+            instance_data = instance_data._replace(not_modified=True)
+        else:
+            instance_data = instance_data._replace(tools=tools, fingerprint=tools.fingerprint)
+    except (ConnectionError, HarvestTimeout, requests.exceptions.RequestException) as e:
+        instance_data = instance_data._replace(error=e)
+    except Exception as e:
+        # a worker must never take the whole harvest down
+        traceback.print_exc()
+        instance_data = instance_data._replace(error=e)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+
+    return instance_data._replace(duration=time.time() - start)
+
+
+def harvest_instances(urls, workers=None, timeout=None, previous=None, geo_cache=None, profile=False, session=None):
+    """
+    Fetch ``urls`` with a pool of at most ``workers`` threads, ``previous`` maps urls to
+    the validators of fetch_instance.
+
+    InstanceData are yielded in the calling thread as soon as each instance
+    is downloaded, so the caller stays the only one writing to the database.
+    At most ``workers`` instances are fetched ahead of the caller: the next
+    one starts when the caller takes a finished one, so that downloaded tool
+    lists do not pile up in memory while the caller stores the previous ones.
+    """
+
+    if previous is None:
+        previous = {}
+    if workers is None:
+        workers = cpu_count()
+
+    finished = Queue.Queue()
+
+    def fetch(url):
+        try:
+            finished.put((fetch_instance(url, timeout=timeout, previous=previous.get(url, None), geo_cache=geo_cache,
+                                         profile=profile, session=session), None))
+        except Exception as e:
+            finished.put((None, e))
+
+    urls = iter(urls)
+    pool = ThreadPool(processes=workers)
+    try:
+        pending = 0
+        for url in islice(urls, workers):
+            pool.apply_async(fetch, (url,))
+            pending += 1
+        while pending:
+            instance_data, error = finished.get()
+            pending -= 1
+            for url in islice(urls, 1):
+                pool.apply_async(fetch, (url,))
+                pending += 1
+            if error is not None:
+                raise error
+            yield instance_data
+    finally:
+        pool.terminate()
@@ -0,0 +1,67 @@
+# coding=utf-8
+
+""" HTTP session shared by every request of the harvest: keep-alive connection pools, timeouts and retries """
+
+import requests
+
+from galaxycat import __version__
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+
+# answers worth retrying: rate limiting, overloaded or restarting servers behind a proxy
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class HarvestSession(requests.Session):
+    """
+    A requests Session which never waits forever and retries transient failures.
+
+    Connections are kept alive in a pool of ``pool_size`` connections per host.
+    Requests without a timeout wait at most ``connect_timeout`` seconds for the
+    connection and ``timeout`` seconds between two reads. Failed connections and
+    RETRY_STATUSES answers to GET requests are retried up to ``retries`` times,
+    waiting ``backoff_factor`` * 2 ** (retry - 1) seconds in between, or what
+    the server asks for with Retry-After. Read timeouts are not retried, a slow
+    server would otherwise hold a harvest worker for ``retries`` + 1 timeouts.
+    Bodies are compressed with gzip when the server supports it and
+    decompressed as they are read.
+    """
+
+    def __init__(self, timeout=60, connect_timeout=10, retries=3, backoff_factor=0.5, pool_size=10):
+        super(HarvestSession, self).__init__()
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+
+        retry = Retry(total=retries, connect=retries, read=False, status=retries, backoff_factor=backoff_factor,
+                      status_forcelist=RETRY_STATUSES, method_whitelist=frozenset(['GET', 'HEAD']), raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=100, pool_maxsize=pool_size, max_retries=retry)
+        self.mount('http://', adapter)
+        self.mount('https://', adapter)
+
+        self.headers['Accept-Encoding'] = 'gzip, deflate'
+        self.headers['User-Agent'] = 'galaxycat/%s %s' % (__version__, self.headers['User-Agent'])
+
+    def request(self, method, url, **kwargs):
+
+        timeout = kwargs.get('timeout', None)
+        if timeout is None:
+            timeout = self.timeout
+        if timeout is not None and not isinstance(timeout, tuple):
+            timeout = (min(self.connect_timeout, timeout) if self.connect_timeout is not None else timeout, timeout)
+        kwargs['timeout'] = timeout
+
+        return super(HarvestSession, self).request(method, url, **kwargs)
+
+
+default_session = None
+
+
+def get_session():
+    """ Session used when none is given, with the default settings """
+
+    global default_session
+
+    if default_session is None:
+        default_session = HarvestSession()
+    return default_session
@@ -0,0 +1,172 @@
+# coding=utf-8
+
+""" Timings, SQL statements and profiles of a harvest """
+
+import cProfile
+import json
+import os
+import pstats
+import re
+import time
+
+from contextlib import contextmanager
+from sqlalchemy import event
+
+
+STAGES = ('config', 'geo', 'tools', 'edam', 'db')
+
+
+class InstanceStats(object):
+    """
+    What a harvest spent on one instance. Nested stages are exclusive, the
+    time spent resolving EDAM operations while storing tools is not
+    counted in the db stage.
+    """
+
+    def __init__(self, url):
+        self.url = url
+        self.timings = dict.fromkeys(STAGES, 0.0)
+        self.statements = 0
+        self.rows = 0
+        self.status = 'ok'
+        self.stack = []
+        self.last = None
+
+    def charge(self):
+        now = time.time()
+        if self.stack:
+            self.timings[self.stack[-1]] += now - self.last
+        self.last = now
+
+    @contextmanager
+    def stage(self, name):
+        self.charge()
+        self.stack.append(name)
+        try:
+            yield
+        finally:
+            self.charge()
+            self.stack.pop()
+
+    @property
+    def duration(self):
+        return sum(self.timings.values())
+
+    def to_dict(self):
+        return {'url': self.url,
+                'status': self.status,
+                'timings': self.timings,
+                'duration': self.duration,
+                'statements': self.statements,
+                'rows': self.rows}
+
+
+class HarvestStats(object):
+    """
+    Collects an InstanceStats per harvested instance. SQL statements sent to
+    ``engine`` are counted for the instance being stored, the others (EDAM
+    prefetch, orphans...) are counted for the catalog itself.
+
+    When ``profile_dir`` is set, each instance is profiled with cProfile and
+    its profile written to ``profile_dir``.
+    """
+
+    def __init__(self, engine, profile_dir=None):
+        self.engine = engine
+        self.profile_dir = profile_dir
+        self.catalog = InstanceStats(None)
+        self.instances = []
+        self.current = None
+        self.start_time = None
+        self.end_time = None
+
+    @property
+    def profile(self):
+        return self.profile_dir is not None
+
+    def count_statement(self, conn, cursor, statement, parameters, context, executemany):
+        stats = self.current if self.current is not None else self.catalog
+        stats.statements += 1
+        if cursor.rowcount > 0:
+            stats.rows += cursor.rowcount
+
+    def __enter__(self):
+        self.start_time = time.time()
+        event.listen(self.engine, 'after_cursor_execute', self.count_statement)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        event.remove(self.engine, 'after_cursor_execute', self.count_statement)
+        self.end_time = time.time()
+
+    @contextmanager
+    def instance(self, instance_data):
+        """ Track what storing ``instance_data`` costs, the fetch timings come from harvest.fetch_instance """
+
+        stats = InstanceStats(instance_data.url)
+        stats.timings.update(instance_data.timings)
+        if instance_data.error is not None:
+            stats.status = 'error'
+        elif instance_data.not_modified or instance_data.tools is None:
+            stats.status = 'not modified'
+
+        profiler = cProfile.Profile() if self.profile else None
+        self.current = stats
+        try:
+            if profiler is not None:
+                profiler.enable()
+            with stats.stage('db'):
+                yield stats
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                self.dump_profile(instance_data, profiler)
+            self.current = None
+            self.instances.append(stats)
+
+    def dump_profile(self, instance_data, profiler):
+        profile = pstats.Stats(profiler)
+        if instance_data.profile is not None:
+            # the download ran in a worker thread, with its own profiler
+            profile.add(instance_data.profile)
+        if not os.path.isdir(self.profile_dir):
+            os.makedirs(self.profile_dir)
+        profile.dump_stats(os.path.join(self.profile_dir, '%s.prof' % re.sub(r'[^\w.-]+', '_', instance_data.url).strip('_')))
+
+    @property
+    def duration(self):
+        end_time = self.end_time if self.end_time is not None else time.time()
+        return end_time - self.start_time if self.start_time is not None else 0.0
+
+    def to_dict(self):
+        totals = dict((stage, sum(stats.timings[stage] for stats in self.instances + [self.catalog])) for stage in STAGES)
+        return {'duration': self.duration,
+                'timings': totals,
+                'statements': sum(stats.statements for stats in self.instances) + self.catalog.statements,
+                'rows': sum(stats.rows for stats in self.instances) + self.catalog.rows,
+                'catalog': self.catalog.to_dict(),
+                'instances': [stats.to_dict() for stats in sorted(self.instances, key=lambda stats: stats.url)]}
+
+    def write_json(self, path):
+        with open(path, 'w') as report:
+            json.dump(self.to_dict(), report, indent=2, sort_keys=True)
+
+    def summary(self):
+        """ Text table of the instances, slowest first """
+
+        header = ['instance', 'status'] + list(STAGES) + ['total', 'sql', 'rows']
+        lines = []
+        for stats in sorted(self.instances, key=lambda stats: stats.duration, reverse=True) + [self.catalog]:
+            lines.append([stats.url or '(catalog)', stats.status] +
+                         ['%.2f' % stats.timings[stage] for stage in STAGES] +
+                         ['%.2f' % stats.duration, str(stats.statements), str(stats.rows)])
+        report = self.to_dict()
+        lines.append(['total', ''] + ['%.2f' % report['timings'][stage] for stage in STAGES] +
+                     ['%.2f' % report['duration'], str(report['statements']), str(report['rows'])])
+
+        widths = [max(len(line[column]) for line in [header] + lines) for column in range(len(header))]
+
+        def format_line(line):
+            return '  '.join(cell.ljust(width) if column < 2 else cell.rjust(width) for column, (cell, width) in enumerate(zip(line, widths)))
+
+        return '\n'.join([format_line(header), format_line(['-' * width for width in widths])] + [format_line(line) for line in lines])
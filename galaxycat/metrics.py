@@ -0,0 +1,176 @@
+# coding=utf-8
+
+""" Request, SQL and template metrics of the webapp, exposed in the Prometheus text format """
+
+import logging
+import threading
+import time
+
+from flask import Response, g, has_request_context, request
+from sqlalchemy import event
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, unicode(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                             for name, value in zip(names, values))
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class Counter(object):
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def expose(self):
+        lines = ['# HELP %s %s' % (self.name, self.documentation), '# TYPE %s counter' % self.name]
+        with self.lock:
+            for labels, value in sorted(self.values.iteritems()):
+                lines.append('%s%s %s' % (self.name, format_labels(self.labels, labels), format_value(value)))
+        return lines
+
+
+class Histogram(object):
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self.lock:
+            counts, total = self.values.get(labels, ([0] * len(self.buckets), 0.0))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            self.values[labels] = (counts, total + value)
+
+    def expose(self):
+        lines = ['# HELP %s %s' % (self.name, self.documentation), '# TYPE %s histogram' % self.name]
+        with self.lock:
+            for labels, (counts, total) in sorted(self.values.iteritems()):
+                for bound, count in zip(self.buckets, counts):
+                    lines.append('%s_bucket%s %d' % (self.name, format_labels(self.labels + ('le',), labels + (format_value(bound),)), count))
+                lines.append('%s_sum%s %s' % (self.name, format_labels(self.labels, labels), format_value(total)))
+                lines.append('%s_count%s %d' % (self.name, format_labels(self.labels, labels), counts[-1]))
+        return lines
+
+
+class Metrics(object):
+    """
+    Opt-in instrumentation of a Flask app: latency of each route, SQL
+    statements sent by the requests (through SQLAlchemy engine events) and
+    template render time. Metrics are exposed on ``/metrics``, they are
+    kept per process.
+
+    Statements slower than ``slow_query_threshold`` seconds are logged, and
+    with ``server_timing`` every response gets a Server-Timing header with
+    its SQL and render times.
+    """
+
+    def __init__(self, app, engine, slow_query_threshold=None, server_timing=False):
+        self.slow_query_threshold = slow_query_threshold
+        self.server_timing = server_timing
+        if slow_query_threshold is not None and not logging.getLogger().handlers and not logger.handlers:
+            # nothing configured logging, slow queries would not be reported
+            logger.addHandler(logging.StreamHandler())
+
+        self.requests = Counter('galaxycat_requests_total', 'Requests served', ('endpoint', 'method', 'status'))
+        self.request_duration = Histogram('galaxycat_request_duration_seconds', 'Time spent serving requests', ('endpoint', 'method'))
+        self.sql_statements = Counter('galaxycat_sql_statements_total', 'SQL statements sent while serving requests', ('endpoint',))
+        self.sql_duration = Histogram('galaxycat_sql_duration_seconds', 'Time spent in SQL statements per request', ('endpoint',))
+        self.slow_queries = Counter('galaxycat_sql_slow_statements_total', 'SQL statements slower than the slow query threshold', ('endpoint',))
+        self.render_duration = Histogram('galaxycat_template_render_seconds', 'Time spent rendering templates', ('template',))
+        self.collectors = [self.requests, self.request_duration, self.sql_statements, self.sql_duration, self.slow_queries, self.render_duration]
+
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+        app.add_url_rule('/metrics', 'metrics', self.expose)
+        event.listen(engine, 'before_cursor_execute', self.before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self.after_cursor_execute)
+
+        metrics = self
+
+        class TimedTemplate(app.jinja_env.template_class):
+
+            def render(self, *args, **kwargs):
+                start = time.time()
+                try:
+                    return super(TimedTemplate, self).render(*args, **kwargs)
+                finally:
+                    metrics.record_render(self.name, time.time() - start)
+
+        app.jinja_env.template_class = TimedTemplate
+
+    def before_request(self):
+        g.metrics = {'start': time.time(), 'sql_statements': 0, 'sql_duration': 0.0, 'render_duration': 0.0}
+
+    def after_request(self, response):
+        request_metrics = g.get('metrics', None)
+        if request_metrics is None:
+            return response
+
+        endpoint = request.endpoint or 'unknown'
+        duration = time.time() - request_metrics['start']
+        self.requests.inc((endpoint, request.method, response.status_code))
+        self.request_duration.observe((endpoint, request.method), duration)
+        self.sql_statements.inc((endpoint,), request_metrics['sql_statements'])
+        self.sql_duration.observe((endpoint,), request_metrics['sql_duration'])
+
+        if self.server_timing:
+            response.headers['Server-Timing'] = 'sql;desc="%d statements";dur=%.1f, render;dur=%.1f, total;dur=%.1f' % (
+                request_metrics['sql_statements'], request_metrics['sql_duration'] * 1000,
+                request_metrics['render_duration'] * 1000, duration * 1000)
+        return response
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_start', []).append(time.time())
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        duration = time.time() - conn.info['metrics_start'].pop()
+        if not has_request_context():
+            return
+
+        request_metrics = g.get('metrics', None)
+        if request_metrics is not None:
+            request_metrics['sql_statements'] += 1
+            request_metrics['sql_duration'] += duration
+
+        if self.slow_query_threshold is not None and duration >= self.slow_query_threshold:
+            self.slow_queries.inc((request.endpoint or 'unknown',))
+            logger.warning("Slow query (%.3fs) on %s: %s", duration, request.path, statement)
+
+    def record_render(self, template, duration):
+        self.render_duration.observe((template or 'string',), duration)
+        if has_request_context():
+            request_metrics = g.get('metrics', None)
+            if request_metrics is not None:
+                request_metrics['render_duration'] += duration
+
+    def expose(self):
+        lines = []
+        for collector in self.collectors:
+            lines.extend(collector.expose())
+        return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
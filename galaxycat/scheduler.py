@@ -0,0 +1,281 @@
+# coding=utf-8
+
+""" Continuous harvest: each instance is refreshed on its own adaptive schedule by a long-running daemon """
+
+import os
+import random
+import signal
+import socket
+import time
+import traceback
+
+from datetime import datetime, timedelta
+from galaxycat.app import app, db
+from galaxycat.catalog import CatalogStatus, EDAMOperation, Instance, Tool, geo_cache, get_http_session
+from multiprocessing.pool import ThreadPool
+from sqlalchemy import func, or_
+from sqlalchemy.exc import IntegrityError
+
+
+def next_interval(interval, changed, duration, config):
+    """
+    Seconds to wait before refreshing an instance harvested successfully.
+
+    The interval shrinks when the tools changed and grows when they did not, between
+    HARVESTD_MIN_INTERVAL and HARVESTD_MAX_INTERVAL, so that busy instances are
+    refreshed often and quiet ones rarely. Slow instances are never refreshed more
+    often than HARVESTD_DURATION_FACTOR times the ``duration`` of their harvest.
+    """
+
+    if interval is None:
+        interval = config['HARVESTD_INTERVAL']
+    interval = interval / 2.0 if changed else interval * 1.5
+    interval = max(interval, duration * config['HARVESTD_DURATION_FACTOR'])
+    return min(max(interval, config['HARVESTD_MIN_INTERVAL']), config['HARVESTD_MAX_INTERVAL'])
+
+
+def retry_delay(failures, config):
+    """ Seconds to wait before retrying an instance which failed ``failures`` times in a row, doubled after each failure """
+
+    return min(config['HARVESTD_RETRY_INTERVAL'] * 2 ** min(failures - 1, 16), config['HARVESTD_MAX_INTERVAL'])
+
+
+def jittered(delay, jitter):
+    """ Spread ``delay`` by +/- ``jitter`` so that instances added together are not refreshed together forever """
+
+    return delay * random.uniform(1 - jitter, 1 + jitter)
+
+
+def active_lock(now, ttl):
+    """ Condition on the instances locked by a harvest for less than ``ttl`` seconds """
+
+    return (Instance.harvest_lock_owner != None) & (Instance.harvest_lock_date >= now - timedelta(seconds=ttl))  # NOQA
+
+
+def unlocked(now, ttl):
+    """ Negation of active_lock(), spelled out because NOT on NULL columns is NULL """
+
+    return or_(Instance.harvest_lock_owner == None, Instance.harvest_lock_date < now - timedelta(seconds=ttl))  # NOQA
+
+
+def lock_owner():
+    """ Owner of the harvest locks taken by this process """
+
+    return u'%s:%d' % (socket.gethostname(), os.getpid())
+
+
+def acquire_lock(instance_id, owner, ttl):
+    """
+    Lock an instance for ``owner``, returns False when another harvest holds it.
+
+    The lock is a conditional UPDATE committed at once, so two daemons (or two
+    hosts) can never claim the same instance whatever the database. Locks older
+    than ``ttl`` seconds were left by a harvest which died and can be taken over.
+    The update_catalog and add_instance commands take the same locks.
+    """
+
+    now = datetime.now()
+    instance_table = Instance.__table__
+    result = db.session.execute(instance_table.update()
+                                              .where(instance_table.c.id == instance_id)
+                                              .where(unlocked(now, ttl))
+                                              .values(harvest_lock_owner=owner, harvest_lock_date=now))
+    db.session.commit()
+    return result.rowcount == 1
+
+
+def release_locks(owner):
+
+    instance_table = Instance.__table__
+    db.session.execute(instance_table.update()
+                                     .where(instance_table.c.harvest_lock_owner == owner)
+                                     .values(harvest_lock_owner=None, harvest_lock_date=None))
+    db.session.commit()
+
+
+def harvest_status(config=None, horizon=24):
+    """
+    Queue depth and harvests in flight, read from the instance table so that the
+    webapp can report on daemons running elsewhere. ``upcoming`` counts the
+    harvests scheduled in each of the next ``horizon`` hours.
+    """
+
+    if config is None:
+        config = app.config
+
+    now = datetime.now()
+    due = or_(Instance.next_harvest_date == None, Instance.next_harvest_date <= now)  # NOQA
+
+    in_flight = Instance.query.filter(active_lock(now, config['HARVESTD_LOCK_TTL'])).order_by(Instance.harvest_lock_date).all()
+    upcoming = [0] * horizon
+    query = db.session.query(Instance.next_harvest_date)\
+        .filter(Instance.next_harvest_date > now)\
+        .filter(Instance.next_harvest_date <= now + timedelta(hours=horizon))
+    for next_harvest_date, in query:
+        upcoming[min(int((next_harvest_date - now).total_seconds() // 3600), horizon - 1)] += 1
+
+    return {'instances': Instance.query.count(),
+            'due': Instance.query.filter(due).filter(unlocked(now, config['HARVESTD_LOCK_TTL'])).count(),
+            'failing': Instance.query.filter(Instance.harvest_failures > 0).count(),
+            'in_flight': [{'url': instance.url,
+                           'owner': instance.harvest_lock_owner,
+                           'since': instance.harvest_lock_date.isoformat()} for instance in in_flight],
+            'next_harvest_date': _isoformat(db.session.query(func.min(Instance.next_harvest_date))
+                                            .filter(Instance.next_harvest_date > now).scalar()),
+            'upcoming': upcoming}
+
+
+def _isoformat(date):
+    return date.isoformat() if date is not None else None
+
+
+class HarvestDaemon(object):
+    """
+    Refresh each instance when it is due, at most ``workers`` at once.
+
+    Instances are downloaded by a pool of threads and stored by the thread calling
+    run(), one transaction per instance, so the webapp sees each refresh as soon
+    as it is stored. Each instance is locked in the database while it is harvested.
+    """
+
+    def __init__(self, workers=None, timeout=None, config=None):
+
+        self.config = config if config is not None else app.config
+        self.workers = workers if workers is not None else self.config['HARVEST_WORKERS']
+        self.timeout = timeout if timeout is not None else self.config['HARVEST_TIMEOUT']
+        self.owner = lock_owner()
+        self.in_flight = {}  # instance id: (url, AsyncResult of fetch_instance)
+        self.stopping = False
+        self.last_cleanup = time.time()
+
+    def stop(self, *args):
+        if not self.stopping:
+            print "Stopping after the %d harvests in flight" % len(self.in_flight)
+        self.stopping = True
+
+    def due_instances(self, limit):
+
+        now = datetime.now()
+        query = Instance.query.filter(or_(Instance.next_harvest_date == None, Instance.next_harvest_date <= now))\
+                              .filter(unlocked(now, self.config['HARVESTD_LOCK_TTL']))  # NOQA
+        if self.in_flight:
+            query = query.filter(~Instance.id.in_(self.in_flight.keys()))
+        # new instances first, then the most overdue
+        return query.order_by(Instance.next_harvest_date != None, Instance.next_harvest_date).limit(limit).all()  # NOQA
+
+    def start_due(self, pool):
+
+        from galaxycat.harvest import fetch_instance
+
+        free = self.workers - len(self.in_flight)
+        if free <= 0:
+            return
+
+        # acquire_lock() commits and expires the instances, read them first
+        instances = []
+        for instance in self.due_instances(free):
+            instance.cache_location()
+            instances.append((instance.id, instance.url, instance.get_validators()))
+
+        for instance_id, url, previous in instances:
+            if not acquire_lock(instance_id, self.owner, self.config['HARVESTD_LOCK_TTL']):
+                continue
+            self.in_flight[instance_id] = (url, pool.apply_async(fetch_instance, (url,), {'timeout': self.timeout,
+                                                                                            'previous': previous,
+                                                                                            'geo_cache': geo_cache,
+                                                                                            'session': get_http_session()}))
+            print "Harvesting %s (%d in flight)" % (url, len(self.in_flight))
+
+    def store_finished(self):
+
+        for instance_id, (url, result) in self.in_flight.items():
+            if result.ready():
+                del self.in_flight[instance_id]
+                self.store(instance_id, result.get())
+
+    def store(self, instance_id, instance_data, attempts=2):
+        """ Store a downloaded instance, schedule its next harvest and release its lock in the same transaction """
+
+        try:
+            instance = Instance.query.get(instance_id)
+            if instance is None:
+                # store_instance() would add it again
+                print "%s was deleted during its harvest" % instance_data.url
+                return
+            fingerprint = instance.tools_fingerprint
+            changed = Instance.store_instance(instance_data, commit=False)
+
+            if instance_data.error is None:
+                instance.harvest_failures = 0
+                if fingerprint is None:
+                    # the first harvest of an instance tells nothing about how often it changes
+                    instance.harvest_interval = self.config['HARVESTD_INTERVAL']
+                else:
+                    instance.harvest_interval = next_interval(instance.harvest_interval, instance.tools_fingerprint != fingerprint,
+                                                              instance_data.duration, self.config)
+                delay = instance.harvest_interval
+            else:
+                instance.harvest_failures = (instance.harvest_failures or 0) + 1
+                delay = retry_delay(instance.harvest_failures, self.config)
+            instance.next_harvest_date = datetime.now() + timedelta(seconds=jittered(delay, self.config['HARVESTD_JITTER']))
+            instance.harvest_lock_owner = None
+            instance.harvest_lock_date = None
+
+            if changed:
+                CatalogStatus.bump()
+            db.session.commit()
+            print "%s: next harvest on %s" % (instance_data.url, instance.next_harvest_date.strftime('%Y-%m-%d %H:%M'))
+        except IntegrityError:
+            db.session.rollback()
+            if attempts <= 1:
+                traceback.print_exc()
+                return
+            # another harvest added the same new tool or EDAM operation first, it is updated this time
+            self.store(instance_id, instance_data, attempts - 1)
+        except Exception:
+            # the instance is retried once its lock expires
+            traceback.print_exc()
+            db.session.rollback()
+
+    def cleanup(self):
+        """ Delete orphan tools every HARVESTD_CLEANUP_INTERVAL seconds rather than after every instance """
+
+        if time.time() - self.last_cleanup < self.config['HARVESTD_CLEANUP_INTERVAL']:
+            return
+        self.last_cleanup = time.time()
+        try:
+            report = Tool.delete_orphans()
+            print "%d orphan tools and %d orphan tool versions deleted" % (report['tool'], report['tool_version'])
+            if sum(report.values()) > 0:
+                CatalogStatus.bump()
+            db.session.commit()
+        except Exception:
+            traceback.print_exc()
+            db.session.rollback()
+
+    def run(self, edam_dump=None):
+        """ Harvest until SIGINT or SIGTERM, then wait for the harvests in flight """
+
+        if edam_dump is not None:
+            EDAMOperation.prefetch(dump=edam_dump)
+
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGTERM, self.stop)
+        print "harvestd %s started with %d workers" % (self.owner, self.workers)
+
+        pool = ThreadPool(processes=self.workers)
+        try:
+            while not self.stopping or self.in_flight:
+                self.store_finished()
+                if not self.stopping:
+                    self.start_due(pool)
+                    self.cleanup()
+                if self.in_flight or not self.stopping:
+                    # the read transaction of due_instances() must not block the writers of an SQLite catalog while sleeping
+                    db.session.rollback()
+                    time.sleep(self.config['HARVESTD_POLL_INTERVAL'])
+        finally:
+            pool.terminate()
+            db.session.rollback()
+            release_locks(self.owner)
+            db.session.remove()
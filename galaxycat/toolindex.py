@@ -0,0 +1,122 @@
+# coding=utf-8
+
+""" Reduces the tool list of a Galaxy instance to the tools and versions stored in the catalog """
+
+import hashlib
+import json
+import re
+
+from collections import namedtuple
+
+# ijson is a requirement, environments installed without it decode tool lists with response.json()
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+
+# what the catalog keeps of a tool list: {name: tool}, {natural key: VERSION_FIELDS tuple} and the fingerprint of the list
+ToolIndex = namedtuple('ToolIndex', ['tools', 'versions', 'fingerprint'])
+
+VERSION_FIELDS = ('name', 'version', 'changeset', 'tool_shed', 'owner')
+
+# fields of the tool elements stored in the catalog, changes to other fields do not trigger an update
+FINGERPRINT_FIELDS = ('id', 'name', 'description', 'version', 'link', 'edam_operations', 'tool_shed_repository')
+
+
+def version_key(version_data):
+    """ Key identifying a tool version across instances, ``version_data`` is a row or a dict """
+
+    if version_data['tool_shed'] is None and version_data['owner'] is None:
+        return (version_data['name'], version_data['version'])
+    else:
+        return (version_data['name'], version_data['changeset'], version_data['tool_shed'], version_data['owner'])
+
+
+def version_sort_key(version):
+    """
+    Key ordering tool versions like version numbers rather than like strings, 1.9 before
+    1.10. Numbers are compared as integers and words as lower-case strings, a number
+    before a word (1.0.1 before 1.0-beta) and a version before its extensions (1.0 before
+    1.0.1). The key is a string of digits and letters only, so that the database sorts it
+    in the same order whatever its collation.
+    """
+
+    key = []
+    for number, word in re.findall(r'(\d+)|([a-z]+)', version.lower()):
+        if number:
+            number = number.lstrip('0') or '0'
+            key.append(u'1%02d%s' % (len(number), number))
+        else:
+            key.append(u'2%s' % word)
+    return u''.join(key)
+
+
+def index_tools(elements, version):
+    """
+    Reduce the elements of a tool list to the tools and versions stored in the catalog.
+
+    Elements are consumed one at a time, so ``elements`` may be a generator over a
+    response being parsed: only the tools, their distinct versions and a digest of
+    every element are kept. The last element of a tool wins. The fingerprint does
+    not depend on the order of the elements.
+    """
+
+    tools = {}
+    versions = {}
+    digests = []
+    # names, owners and tool sheds repeat across elements, keep a single copy of each
+    strings = {}
+    for element in elements:
+        if element.get('model_class') != 'Tool':
+            continue
+
+        normalized = dict((key, element.get(key)) for key in FINGERPRINT_FIELDS)
+        # ijson parses decimal numbers as Decimal
+        digests.append(hashlib.sha1(json.dumps(normalized, sort_keys=True, default=unicode)).digest())
+
+        tool_name = element['id']
+        if '/' in tool_name:
+            tool_name = tool_name.split('/')[-2]
+        tool_name = strings.setdefault(tool_name, tool_name)
+
+        tool_data = tools.setdefault(tool_name, {'name': tool_name, 'link': None, 'edam_operations': set()})
+        tool_data['description'] = element['description']
+        tool_data['display_name'] = element['name']
+        if 'link' in element:
+            link = element.get('link', None)
+            link_start = link.find('/tool_runner')
+            if link_start != -1:
+                tool_data['link'] = link[link_start:]
+        tool_data['edam_operations'].update(element.get('edam_operations', []))
+
+        version_data = {'name': tool_name, 'version': element['version'], 'changeset': None, 'tool_shed': None, 'owner': None}
+        if 'tool_shed_repository' in element:
+            version_data['changeset'] = element['tool_shed_repository']['changeset_revision']
+            version_data['tool_shed'] = strings.setdefault(element['tool_shed_repository']['tool_shed'], element['tool_shed_repository']['tool_shed'])
+            version_data['owner'] = strings.setdefault(element['tool_shed_repository']['owner'], element['tool_shed_repository']['owner'])
+        key = version_key(version_data)
+        if key not in versions:
+            versions[key] = tuple(version_data[field] for field in VERSION_FIELDS)
+
+    fingerprint = hashlib.sha1(json.dumps(version))
+    for digest in sorted(digests):
+        fingerprint.update(digest)
+    return ToolIndex(tools=tools, versions=versions, fingerprint=unicode(fingerprint.hexdigest()))
+
+
+streaming_warned = False  # the fallback to response.json() is reported once per process
+
+
+def iter_elements(response):
+    """ Yields the elements of a JSON list response, parsed as the body arrives when ijson is installed """
+
+    global streaming_warned
+
+    if ijson is None:
+        if not streaming_warned:
+            streaming_warned = True
+            print "Warning: ijson is not installed, tool lists are decoded in one go and held in memory"
+        return iter(response.json())
+    response.raw.decode_content = True
+    return ijson.items(response.raw, 'item')
@@ -0,0 +1,56 @@
+# coding=utf-8
+
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+from galaxycat.config import config
+
+# galaxycat.app reads its configuration on import, the tests run against a temporary SQLite database
+database_dir = tempfile.mkdtemp()
+config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///%s' % os.path.join(database_dir, 'catalog.sqlite')
+
+# the harvest is tested against the fake Galaxy server and the synthetic catalogs of the benchmarks
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+
+@pytest.fixture(scope='session')
+def database():
+
+    from galaxycat.app import app, db
+    from galaxycat.fulltext import create_search_index
+
+    db.create_all()
+    search_index = create_search_index(db, app.config['SEARCH_BACKEND'])
+    if search_index is not None:
+        search_index.create()
+        db.session.commit()
+
+    yield db
+
+    db.session.remove()
+    shutil.rmtree(database_dir)
+
+
+@pytest.fixture
+def galaxy_servers():
+    """ Starts a FakeGalaxyServer of ``instances`` synthetic instances per call, they are shut down after the test """
+
+    from fake_galaxy import FakeGalaxyServer
+    from synthetic import generate_catalog
+
+    servers = []
+
+    def start(instances=1, **kwargs):
+        server = FakeGalaxyServer(generate_catalog(instances=instances, tools=20, versions=40), **kwargs).start()
+        servers.append(server)
+        return server
+
+    yield start
+
+    for server in servers:
+        server.shutdown()
+        server.server_close()
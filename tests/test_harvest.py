@@ -0,0 +1,64 @@
+# coding=utf-8
+
+""" Harvest of fake Galaxy servers: slow instances are given up alone, and instances are not fetched far ahead of the caller """
+
+import time
+
+from galaxycat.harvest import HarvestTimeout, harvest_instances
+from galaxycat.http import HarvestSession
+from requests.exceptions import Timeout
+
+
+def instance_urls(server):
+
+    return [server.url(name) for name in sorted(server.instances)]
+
+
+def test_slow_instance_is_given_up_alone(galaxy_servers):
+
+    fast = galaxy_servers(instances=3)
+    slow = galaxy_servers(delay=2)
+    urls = instance_urls(fast) + instance_urls(slow)
+
+    start = time.time()
+    harvested = dict((instance_data.url, instance_data)
+                     for instance_data in harvest_instances(urls, workers=4, timeout=0.5, session=HarvestSession(retries=0)))
+
+    assert time.time() - start < 1.5
+    assert sorted(harvested) == sorted(urls)
+    slow_data = harvested[slow.url('galaxy0')]
+    assert isinstance(slow_data.error, (HarvestTimeout, Timeout))
+    assert slow_data.tools is None
+    for url in instance_urls(fast):
+        assert harvested[url].error is None
+        assert len(harvested[url].tools.tools) > 0
+
+
+def test_timeout_bounds_the_whole_instance(galaxy_servers):
+
+    # each answer comes within the timeout, the configuration and the tool list together do not
+    server = galaxy_servers(delay=0.4)
+
+    instance_data, = harvest_instances(instance_urls(server), workers=1, timeout=0.6, session=HarvestSession(retries=0))
+
+    assert isinstance(instance_data.error, (HarvestTimeout, Timeout))
+    assert instance_data.duration < 0.9
+
+
+def test_instances_fetched_ahead_are_bounded(galaxy_servers):
+
+    server = galaxy_servers(instances=8)
+    workers = 2
+
+    harvested = []
+    for index, instance_data in enumerate(harvest_instances(instance_urls(server), workers=workers, session=HarvestSession())):
+        # a slow caller, storing each instance
+        time.sleep(0.2)
+        with server.lock:
+            started = len([name for name, resource in server.requests if resource == 'configuration'])
+        # the instance taken by the caller, and at most ``workers`` others
+        assert started <= index + 1 + workers
+        harvested.append(instance_data)
+
+    assert len(harvested) == 8
+    assert all(instance_data.error is None for instance_data in harvested)
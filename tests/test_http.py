@@ -0,0 +1,61 @@
+# coding=utf-8
+
+""" HarvestSession against a fake Galaxy server: retries of transient failures and gzip bodies """
+
+import json
+
+from bioblend import ConnectionError
+from galaxycat.harvest import fetch_instance
+from galaxycat.http import HarvestSession
+from galaxycat.toolindex import index_tools, iter_elements
+
+
+def test_failures_are_retried(galaxy_servers):
+
+    server = galaxy_servers(failures=2)
+    session = HarvestSession(retries=3, backoff_factor=0)
+
+    response = session.get(server.url('galaxy0') + 'api/configuration')
+
+    assert response.status_code == 200
+    assert response.json() == server.instances['galaxy0'][0]
+    assert server.requests[('galaxy0', 'configuration')] == 3
+
+
+def test_too_many_failures_are_an_error(galaxy_servers):
+
+    server = galaxy_servers(failures=5)
+    session = HarvestSession(retries=2, backoff_factor=0)
+
+    response = session.get(server.url('galaxy0') + 'api/configuration')
+    assert response.status_code == 503
+    assert server.requests[('galaxy0', 'configuration')] == 3
+
+    # failures are counted per resource, a fresh server fails the configuration of the harvest
+    server = galaxy_servers(failures=5)
+    instance_data = fetch_instance(server.url('galaxy0'), timeout=5, session=session)
+    assert server.requests[('galaxy0', 'configuration')] == 3
+    assert isinstance(instance_data.error, ConnectionError)
+    assert instance_data.error.status_code == 503
+    assert instance_data.tools is None
+
+
+def test_gzip_bodies_are_decoded(galaxy_servers):
+
+    server = galaxy_servers(gzip=True)
+    session = HarvestSession()
+    tools = server.instances['galaxy0'][1]
+
+    response = session.get(server.url('galaxy0') + 'api/tools')
+    assert 'gzip' in response.request.headers['Accept-Encoding']
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert int(response.headers['Content-Length']) < len(json.dumps(tools))
+    assert response.json() == tools
+
+    # the tool lists of the harvest are streamed
+    response = session.get(server.url('galaxy0') + 'api/tools', stream=True)
+    assert list(iter_elements(response)) == tools
+
+    instance_data = fetch_instance(server.url('galaxy0'), timeout=5, session=session)
+    assert instance_data.error is None
+    assert instance_data.tools == index_tools(iter(tools), instance_data.config['version'])
@@ -0,0 +1,71 @@
+# coding=utf-8
+
+""" The search results page is rendered in a fixed number of SQL statements, whatever the number of tools found """
+
+import pytest
+
+from galaxycat.app import app, db
+from galaxycat.catalog import CatalogStatus, EDAMOperation, Instance, Tool, ToolVersion, get_availability_index
+from galaxycat.fulltext import get_search_index
+from sqlalchemy import event
+
+# CatalogStatus, the count of the tools found, the page of tools and their EDAM operations
+MAX_STATEMENTS = 4
+
+TOOLS_COUNT = 40
+
+
+@pytest.fixture(scope='module')
+def client(database):
+
+    instances = [Instance(url=u'https://galaxy%d.example.org/' % index, brand=u'Galaxy%d' % index) for index in range(3)]
+    operations = [EDAMOperation(operation_id=u'operation_%04d' % index, iri=u'http://edamontology.org/operation_%04d' % index,
+                                label=label) for index, label in enumerate([u'Formatting', u'Sequence analysis'])]
+    for index in range(TOOLS_COUNT):
+        tool = Tool(name=u'bedtools_%d' % index, display_name=u'BEDTools %d' % index, description=u'Process bed file %d' % index,
+                    edam_operations=operations[:index % 2 + 1])
+        for version in range(index % 3 + 1):
+            tool.versions.append(ToolVersion(name=tool.name, version=u'2.%d' % version, instances=instances[:version + 1]))
+        db.session.add(tool)
+    db.session.flush()
+
+    search_index = get_search_index(db, app.config['SEARCH_BACKEND'])
+    if search_index is not None:
+        search_index.rebuild()
+    CatalogStatus.bump()
+    db.session.commit()
+
+    # the availability index is built once per catalog generation, the search index above is looked up once per process
+    get_availability_index()
+
+    yield app.test_client()
+
+
+@pytest.fixture
+def statements():
+
+    statements = []
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        # the BEGIN of SQLite transactions, see galaxycat.app, is not a query
+        if statement != 'BEGIN':
+            statements.append(statement)
+
+    event.listen(db.engine, 'after_cursor_execute', after_cursor_execute)
+    yield statements
+    event.remove(db.engine, 'after_cursor_execute', after_cursor_execute)
+
+
+@pytest.mark.parametrize('search,tools_count', [(u'bed', TOOLS_COUNT),
+                                                (u'tools', TOOLS_COUNT),
+                                                (u'bed topic:Formatting', TOOLS_COUNT),
+                                                (u'topic:"Sequence analysis"', TOOLS_COUNT // 2),
+                                                (u'bed instance:Galaxy2', TOOLS_COUNT // 3),
+                                                (u'instance:Galaxy1', TOOLS_COUNT * 2 // 3)])
+def test_search_statements(client, statements, search, tools_count):
+
+    response = client.get('/', query_string={'search': search})
+
+    assert response.status_code == 200
+    assert response.data.count('<tr>') == tools_count + 1
+    assert len(statements) <= MAX_STATEMENTS, '\n'.join(statements)
@@ -0,0 +1,114 @@
+# coding=utf-8
+
+""" The update_catalog and add_instance commands and harvestd share the harvest locks of the instances """
+
+import pytest
+
+from galaxycat import harvest
+from galaxycat.app import db
+from galaxycat.catalog import CatalogStatus, Instance, Tool, edam_resolver, geo_cache
+from galaxycat.edam import EDAM_IRI, make_term
+from galaxycat.scheduler import HarvestDaemon, acquire_lock
+from synthetic import operation_id, operation_label
+
+OTHER_OWNER = u'elsewhere:1'
+
+
+@pytest.fixture
+def server(database, galaxy_servers, monkeypatch):
+
+    server = galaxy_servers(instances=2)
+    # neither OLS nor ip-api.com are asked
+    for index in range(200):
+        edam_resolver.add(make_term(unicode(EDAM_IRI % operation_id(index)), unicode(operation_label(index)), u''))
+    geo_cache.add('127.0.0.1', {'city': u'Illkirch', 'zip': u'67400', 'country': u'France', 'countryCode': u'FR',
+                                'lat': 48.53, 'lon': 7.71})
+
+    # the instances of the other tests are not harvested
+    harvest_instances = harvest.harvest_instances
+    server_urls = set(server.url(name) for name in server.instances)
+    monkeypatch.setattr(harvest, 'harvest_instances',
+                        lambda urls, **kwargs: harvest_instances([url for url in urls if url in server_urls], **kwargs))
+
+    for name in sorted(server.instances):
+        db.session.add(Instance(url=server.url(name)))
+    db.session.commit()
+
+    yield server
+
+    for name in sorted(server.instances):
+        db.session.delete(Instance.query.filter_by(url=server.url(name)).one())
+    Tool.delete_orphans()
+    db.session.commit()
+
+
+def test_update_catalog_skips_locked_instances(server):
+
+    locked = Instance.query.filter_by(url=server.url('galaxy1')).one()
+    assert acquire_lock(locked.id, OTHER_OWNER, 3600)
+
+    Tool.update_catalog(workers=2, timeout=5)
+
+    assert not any(name == 'galaxy1' for name, resource in server.requests)
+    assert Instance.query.filter_by(url=server.url('galaxy0')).one().tools_fingerprint is not None
+    assert Instance.query.filter(Instance.harvest_lock_owner != None).all() == [locked]  # NOQA
+    assert locked.harvest_lock_owner == OTHER_OWNER
+    assert locked.tools_fingerprint is None
+
+
+def test_instance_failing_to_store_keeps_its_tools(server, monkeypatch):
+
+    Tool.update_catalog(workers=2, timeout=5)
+    tools_counts = dict((name, Instance.query.filter_by(url=server.url(name)).one().get_tools_count()) for name in server.instances)
+    fingerprint = Instance.query.filter_by(url=server.url('galaxy1')).one().tools_fingerprint
+    generation = CatalogStatus.get().generation
+
+    # both instances drop most of their tools, galaxy1 fails to store them
+    server.update(dict((name, (config, tools[:10])) for name, (config, tools) in server.instances.items()))
+    retrieve_tools_from_instance = Tool.retrieve_tools_from_instance.__func__
+
+    def failing_retrieve_tools_from_instance(cls, instance, **kwargs):
+        if instance.url == server.url('galaxy1'):
+            raise RuntimeError('cannot store %s' % instance.url)
+        return retrieve_tools_from_instance(cls, instance=instance, **kwargs)
+
+    monkeypatch.setattr(Tool, 'retrieve_tools_from_instance', classmethod(failing_retrieve_tools_from_instance))
+    # a single worker stores galaxy0 before galaxy1 fails
+    Tool.update_catalog(workers=1, timeout=5)
+
+    assert Instance.query.filter_by(url=server.url('galaxy0')).one().get_tools_count() < tools_counts['galaxy0']
+    failing = Instance.query.filter_by(url=server.url('galaxy1')).one()
+    assert failing.get_tools_count() == tools_counts['galaxy1']
+    assert failing.tools_fingerprint == fingerprint
+    assert CatalogStatus.get().generation == generation + 1
+
+
+def test_add_instance_skips_a_locked_instance(server):
+
+    locked = Instance.query.filter_by(url=server.url('galaxy0')).one()
+    assert acquire_lock(locked.id, OTHER_OWNER, 3600)
+
+    assert not Instance.add_instance(server.url('galaxy0'))
+    assert server.requests == {}
+
+    assert Instance.add_instance(server.url('galaxy1'))
+    instance = Instance.query.filter_by(url=server.url('galaxy1')).one()
+    assert instance.tools_fingerprint is not None
+    assert instance.harvest_lock_owner is None
+
+
+def test_instance_deleted_during_its_harvest_is_not_stored(server, capsys):
+
+    instance = Instance.query.filter_by(url=server.url('galaxy0')).one()
+    instance_id = instance.id
+    instance_data = harvest.fetch_instance(instance.url, timeout=5)
+    db.session.delete(instance)
+    db.session.commit()
+
+    HarvestDaemon().store(instance_id, instance_data)
+
+    assert capsys.readouterr().out == '%s was deleted during its harvest\n' % instance_data.url
+    assert Instance.query.filter_by(url=server.url('galaxy0')).first() is None
+    # for the teardown of the fixture
+    db.session.add(Instance(url=server.url('galaxy0')))
+    db.session.commit()
@@ -0,0 +1,62 @@
+# coding=utf-8
+
+""" Versions are ranked like version numbers, 1.10 after 1.9, by the version drift and the tool documents """
+
+import pytest
+
+from galaxycat.app import db
+from galaxycat.catalog import Instance, Tool, ToolVersion
+from galaxycat.drift import load_version_drift
+from galaxycat.toolindex import version_sort_key
+
+# versions of the tool on each instance
+INSTANCE_VERSIONS = [[u'1.9'], [u'1.9', u'1.10'], [u'1.2'], [u'1.10']]
+
+
+@pytest.fixture(scope='module')
+def tool(database):
+
+    instances = [Instance(url=u'https://drift%d.example.org/' % index) for index in range(len(INSTANCE_VERSIONS))]
+    tool = Tool(name=u'cutadapt', display_name=u'Cutadapt')
+    for version in [u'1.2', u'1.9', u'1.10']:
+        tool.versions.append(ToolVersion(name=tool.name, version=version,
+                                         instances=[instance for instance, versions in zip(instances, INSTANCE_VERSIONS)
+                                                    if version in versions]))
+    db.session.add(tool)
+    db.session.commit()
+
+    return tool
+
+
+@pytest.mark.parametrize('older,newer', [(u'1.9', u'1.10'),
+                                         (u'2.29.2', u'2.29.10'),
+                                         (u'9.0', u'10.0'),
+                                         (u'1.0', u'1.0.1'),
+                                         (u'1.0.1', u'1.0-beta'),
+                                         (u'2.29.2', u'2.29.2+galaxy1'),
+                                         (u'99999999999', u'123456789012')])
+def test_version_sort_key(older, newer):
+
+    assert version_sort_key(older) < version_sort_key(newer)
+
+
+def test_version_sort_key_ignores_leading_zeros_and_case():
+
+    assert version_sort_key(u'1.00') == version_sort_key(u'1.0')
+    assert version_sort_key(u'1.0-Beta') == version_sort_key(u'1.0-beta')
+
+
+def test_drift_ranks_versions_numerically(tool):
+
+    rows = [row for row in load_version_drift().rows if row.tool_id == tool.id]
+
+    assert [(row.newest_version, row.instance, row.version, row.versions_behind) for row in rows] == \
+        [(u'1.10', u'https://drift2.example.org/', u'1.2', 2),
+         (u'1.10', u'https://drift0.example.org/', u'1.9', 1)]
+
+
+def test_tool_document_lists_newest_version_first(tool):
+
+    document = Tool.build_documents([tool.id])[tool.id]
+
+    assert [version['version'] for version in document['versions']] == [u'1.10', u'1.9', u'1.2']